@@ -1,83 +1,313 @@
 import streamlit as st
 import datetime
+import hmac
+import os
+
+from bid_ranking import DEFAULT_WEIGHTS, rank_bids, timeline_quartiles
+from catalog_io import (MATERIAL_EXPORT_FIELDS, ORDER_EXPORT_FIELDS, export_file, import_materials, iter_rows,
+                        material_export_row, order_export_row, validate_material)
+from eventlog import EventLog, recover
+from geo import GridIndex, geocode, haversine_km
+from facets import MATERIAL_FACETS, MATERIAL_RANGES, PROJECT_FACETS, PROJECT_RANGES, FacetIndex
+from ids import ulid
+from metrics import METRICS
+from notifier import LocalBroker, SQLiteBroker, publish_changes
+from price_history import DAY, PERIODS, bucket_start, sparkline, trend
+from query_cache import QueryCache
+from reference_data import DEFAULT_PATH as REFERENCE_DATA_PATH, ReferenceRegistry
+from recommendations import TenderMatcher
+from records import (Availability, Bid, BidStatus, FileStatus, Material, Order, OrderStatus, Project, ProjectStatus,
+                     date_to_ts, format_date, format_datetime, format_money, from_cents, now_ts, to_cents)
+from search_index import MATERIAL_SEARCH_FIELDS, PROJECT_SEARCH_FIELDS, InvertedIndex, tokenize
+from storage import MarketplaceStore
+from uploads import ALLOWED_EXTENSIONS, UploadPipeline
+
+PAGE_SIZE = 20
+TREND_WEEKS = 12
+HISTORY_RANGES = {"Last 30 days": 30, "Last 90 days": 90, "Last year": 365}
+# How often live lists poll the notifier for changes
+LIVE_REFRESH_SECONDS = 5
+DATA_DIR = os.environ.get("PANAMA_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+# PANAMA_MULTIPROCESS=1 for several server processes behind one load
+# balancer (see run_workers.py): sessions live in the database and each
+# process follows the others' writes through the change feed
+MULTI_PROCESS = os.environ.get("PANAMA_MULTIPROCESS", "") not in ("", "0")
+SHARED_SESSION_KEYS = ("role", "user_id", "company", "cart")
+
+@st.cache_resource
+def get_store():
+    # One connection per process, shared by every session. A missing database
+    # is rebuilt from the newest snapshot and the event log behind it.
+    db_path = os.path.join(DATA_DIR, "marketplace.db")
+    log_dir = os.path.join(DATA_DIR, "events")
+    if not os.path.exists(db_path) and os.path.isdir(log_dir):
+        recover(log_dir, db_path)
+    event_log = EventLog(log_dir, db_path)
+    store = MarketplaceStore(db_path, event_log=event_log, change_feed=MULTI_PROCESS)
+    if not event_log.snapshots():
+        event_log.snapshot()
+    return store
+
+@st.cache_resource
+def get_reference_registry():
+    return ReferenceRegistry(os.environ.get("PANAMA_REFERENCE_DATA", REFERENCE_DATA_PATH))
+
+def reference_data():
+    # Categories, project types, locations and statuses; one shared copy
+    # per process, replaced when the config file's version changes
+    return get_reference_registry().get()
+
+@st.cache_resource
+def get_upload_pipeline():
+    return UploadPipeline(get_store())
+
+def build_record_index(table, index):
+    # Keeps a per-process index (search or facets) in step with committed writes
+    store = get_store()
+
+    def reindex(changed_table, record_id):
+        if changed_table == table:
+            record = store.get_record(table, record_id)
+            if record is None:
+                index.remove(record_id)
+            else:
+                index.add(record_id, record)
+
+    # Subscribe before the initial load so no write can slip between the two
+    store.subscribe(reindex)
+    for record in store.list_records(table):
+        index.add(record.id, record)
+    return index
+
+@st.cache_resource
+def get_project_index():
+    return build_record_index("projects", InvertedIndex(PROJECT_SEARCH_FIELDS))
+
+@st.cache_resource
+def get_material_index():
+    return build_record_index("materials", InvertedIndex(MATERIAL_SEARCH_FIELDS))
+
+@st.cache_resource
+def get_project_facets():
+    return build_record_index("projects", FacetIndex(PROJECT_FACETS, PROJECT_RANGES))
+
+@st.cache_resource
+def get_material_facets():
+    return build_record_index("materials", FacetIndex(MATERIAL_FACETS, MATERIAL_RANGES))
+
+@st.cache_resource
+def get_material_locations():
+    return build_record_index("materials", GridIndex())
+
+@st.cache_resource
+def get_tender_matcher():
+    store = get_store()
+    matcher = TenderMatcher()
+
+    def update(table, record_id):
+        if table == "projects":
+            matcher.update_project(record_id, store.get_record("projects", record_id))
+        elif table == "bids":
+            bid = store.get_record("bids", record_id)
+            if bid is not None and bid.user_id:
+                matcher.update_contractor(bid.user_id, contractor_bids(bid.user_id))
+
+    store.subscribe(update)
+    matcher.build(lambda: (store.list_records("projects"), store.list_records("bids")))
+    return matcher
+
+def contractor_bids(user_id):
+    store = get_store()
+    bids = [store.get_record("bids", bid_id) for bid_id in store.list_ids("bids", user_id=user_id)]
+    return [(bid, store.get_record("projects", bid.project_id)) for bid in bids if bid is not None]
+
+@st.cache_resource
+def get_notifier():
+    # PANAMA_BROKER=sqlite shares change notifications between server processes
+    if os.environ.get("PANAMA_BROKER") == "sqlite":
+        broker = SQLiteBroker(os.path.join(DATA_DIR, "notifications.db"))
+    else:
+        broker = LocalBroker()
+    return publish_changes(get_store(), broker)
+
+@st.cache_resource
+def get_query_cache():
+    cache = QueryCache()
+    # Build the indexes first so their listeners run before the version bump;
+    # a result computed from a stale index could otherwise be cached under
+    # the new version.
+    get_project_index()
+    get_material_index()
+    get_project_facets()
+    get_material_facets()
+    get_material_locations()
+    get_store().subscribe(lambda table, record_id: cache.bump(table))
+    return cache
+
+@METRICS.timed
+def find_project_ids(search_text, location, project_type, min_budget, max_budget):
+    # Text matches come back ranked from the index; facets narrow them by set intersection
+    matching_ids = get_project_facets().select(facet_filters(location=location, type=project_type),
+                                               {'budget_cents': (min_budget, max_budget)})
+    ids = intersect_ranked(get_project_index().search(search_text), matching_ids)
+    return tuple(get_store().list_ids('projects') if ids is None else ids)
+
+@METRICS.timed
+def find_material_ids(search_text, category, subcategory, location, availability, min_price, max_price, near=None):
+    matching_ids = get_material_facets().select(
+        facet_filters(category=category, subcategory=subcategory, location=location, availability=availability),
+        {'price_cents': (min_price, max_price)})
+    ids = intersect_ranked(get_material_index().search(search_text), matching_ids)
+    if near is not None:
+        # near is (latitude, longitude, radius_km); distance order wins over search rank
+        ids = intersect_ranked([material_id for _, material_id in get_material_locations().within(*near)], ids)
+    return tuple(get_store().list_ids('materials') if ids is None else ids)
+
+def cached_ids(name, table, find, search_text, *filters):
+    # Results are shared by every session with the same normalized filters
+    # until the table they were read from is written to.
+    params = (" ".join(tokenize(search_text)),) + filters
+    with METRICS.section(f"filter_{name}"):
+        return get_query_cache().get_or_compute(name, (table,), params, lambda: find(search_text, *filters))
+
+def live_query(key, topics, params, load):
+    # Keeps the last result in session state and loads again only when the
+    # params change or a watched topic has been published since, so a
+    # polling fragment leaves the database alone while nothing happens.
+    versions = get_notifier().versions(topics)
+    cached = st.session_state.get(key)
+    if cached is not None and cached[0] == params and cached[1] == versions:
+        return cached[2]
+    result = load()
+    st.session_state[key] = (params, versions, result)
+    return result
+
+def announce(key, topics, message):
+    # Toasts once per batch of changes seen since this session last looked
+    versions = get_notifier().versions(topics)
+    seen = st.session_state.get(key)
+    st.session_state[key] = versions
+    if seen is not None and seen != versions:
+        st.toast(message)
+
+def facet_filters(**selected):
+    # Selectbox values other than the "All" placeholders become facet filters
+    return {field: value for field, value in selected.items() if value not in ('All', 'All Categories')}
+
+def intersect_ranked(ranked_ids, selected_ids):
+    # Either side may be None for "unconstrained"; search rank order wins
+    if ranked_ids is None:
+        return selected_ids
+    if selected_ids is None:
+        return ranked_ids
+    selected_ids = set(selected_ids)
+    return [record_id for record_id in ranked_ids if record_id in selected_ids]
+
+def with_count(counts):
+    return lambda option: f"{option} ({counts[option]})" if option in counts else option
+
+def paginate(items, key, filters=()):
+    # Keeps a page cursor per listing in session state and returns only the
+    # current page, so a rerun never renders more than PAGE_SIZE records.
+    # The cursor goes back to the first page whenever the filters change.
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[key] = 0
+    pages = max(1, -(-len(items) // PAGE_SIZE))
+    page = min(st.session_state.get(key, 0), pages - 1)
+    st.session_state[key] = page
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        col1.button("← Previous", key=f"{key}_prev", disabled=page == 0, on_click=move_page, args=(key, -1))
+        col2.caption(f"Page {page + 1} of {pages} · {len(items)} results")
+        col3.button("Next →", key=f"{key}_next", disabled=page == pages - 1, on_click=move_page, args=(key, 1))
+    return items[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+def move_page(key, step):
+    st.session_state[key] += step
 
 def setup_session_state():
     if 'role' not in st.session_state:
         st.session_state['role'] = None
-    if 'projects' not in st.session_state:
-        st.session_state['projects'] = []
-    if 'materials' not in st.session_state:
-        st.session_state['materials'] = []
-    if 'bids' not in st.session_state:
-        st.session_state['bids'] = []
-    if 'orders' not in st.session_state:
-        st.session_state['orders'] = []
-    if 'categories' not in st.session_state:
-        st.session_state['categories'] = {
-            "Concrete & Cement": ["Ready Mix", "Cement Bags", "Aggregates"],
-            "Steel & Metals": ["Rebar", "Structural Steel", "Sheet Metal"],
-            "Plumbing": ["PVC Pipes", "Copper Pipes", "Fittings", "Fixtures"],
-            "Electrical": ["Wiring", "Conduit", "Panels", "Fixtures"],
-            "Lumber & Wood": ["Plywood", "Dimensional Lumber", "Finishing Wood"],
-            "Finishes": ["Paint", "Tiles", "Flooring", "Drywall"],
-            "Tools & Equipment": ["Power Tools", "Hand Tools", "Safety Equipment"]
-        }
     if 'user_id' not in st.session_state:
-        st.session_state['user_id'] = f"user_{datetime.datetime.now().timestamp()}"
+        st.session_state['user_id'] = f"user_{ulid()}"
+    if 'company' not in st.session_state:
+        # The company name a supplier signed in as
+        st.session_state['company'] = None
+    if 'cart' not in st.session_state:
+        # material id -> quantity, in the order they were added
+        st.session_state['cart'] = {}
 
+@st.cache_resource
 def add_sample_data():
-    if not st.session_state.projects:
-        st.session_state.projects.extend([
-            {
-                "title": "Luxury Apartments in Costa del Este",
-                "location": "Costa del Este, Panama",
-                "type": "High-rise Residential",
-                "budget": 15000000,
-                "description": "20-story luxury apartment building with ocean view",
-                "status": "Open",
-                "date_posted": datetime.datetime.now().strftime("%Y-%m-%d"),
-                "files": [],  # Files will be stored in session state
-                "bids": []
-            },
-            {
-                "title": "Commercial Complex in Obarrio",
-                "location": "Obarrio, Panama",
-                "type": "Commercial Office",
-                "budget": 8000000,
-                "description": "Modern office complex with retail space",
-                "status": "Open",
-                "date_posted": datetime.datetime.now().strftime("%Y-%m-%d"),
-                "files": [],
-                "bids": []
-            }
-        ])
-    if not st.session_state.materials:
-        st.session_state.materials.extend([
-            {
-                "name": "Portland Cement (94lb bag)",
-                "category": "Concrete & Cement",
-                "subcategory": "Cement Bags",
-                "supplier": "Argos",
-                "price": 8.50,
-                "availability": "In Stock",
-                "location": "Panama City",
-                "contact": "6678-9900",
-                "minimum_order": 10
-            },
-            {
-                "name": "PVC Pipe 4\" (6m length)",
-                "category": "Plumbing",
-                "subcategory": "PVC Pipes",
-                "supplier": "Tuberias SA",
-                "price": 12.75,
-                "availability": "In Stock",
-                "location": "Panama City",
-                "contact": "6789-0123",
-                "minimum_order": 5
-            }
-        ])
+    # Once per process rather than per rerun; the counts are checked again
+    # under the write lock in case another process seeds at the same time
+    store = get_store()
+    if store.count('projects') and store.count('materials'):
+        return
+    with store.transaction():
+        if not store.count('projects'):
+            for project in sample_projects():
+                store.add_project(project)
+        if not store.count('materials'):
+            for material in sample_materials():
+                store.add_material(material)
 
+def sample_projects():
+    return [
+        Project(
+            title="Luxury Apartments in Costa del Este",
+            location="Costa del Este, Panama",
+            type="High-rise Residential",
+            budget_cents=to_cents(15000000),
+            description="20-story luxury apartment building with ocean view",
+            status=ProjectStatus.OPEN,
+            posted_at=now_ts()
+        ),
+        Project(
+            title="Commercial Complex in Obarrio",
+            location="Obarrio, Panama",
+            type="Commercial Office",
+            budget_cents=to_cents(8000000),
+            description="Modern office complex with retail space",
+            status=ProjectStatus.OPEN,
+            posted_at=now_ts()
+        )
+    ]
+
+def sample_materials():
+    return [
+        Material(
+            name="Portland Cement (94lb bag)",
+            category="Concrete & Cement",
+            subcategory="Cement Bags",
+            supplier="Argos",
+            price_cents=to_cents(8.50),
+            availability=Availability.IN_STOCK,
+            location="Panama City",
+            contact="6678-9900",
+            minimum_order=10,
+            stock=2000
+        ),
+        Material(
+            name="PVC Pipe 4\" (6m length)",
+            category="Plumbing",
+            subcategory="PVC Pipes",
+            supplier="Tuberias SA",
+            price_cents=to_cents(12.75),
+            availability=Availability.IN_STOCK,
+            location="Panama City",
+            contact="6789-0123",
+            minimum_order=5,
+            stock=400
+        )
+    ]
+
+@METRICS.timed
 def main():
+    if MULTI_PROCESS:
+        restore_session()
+        get_store().sync()
     setup_session_state()
     add_sample_data()
 
@@ -87,10 +317,58 @@ def main():
         show_developer_interface()
     elif st.session_state.role == "Contractor":
         show_contractor_interface()
-    elif st.session_state.role == "Supplier":
+    elif st.session_state.role == "Supplier" and st.session_state.company:
         show_supplier_interface()
     else:
         show_role_selection()
+    show_metrics_panel()
+    if MULTI_PROCESS:
+        save_session()
+
+def restore_session():
+    # The session is named by ?sid= in the URL, so whichever process serves
+    # a rerun can load it from the database the first time it sees it
+    if 'sid' in st.session_state:
+        return
+    sid = st.query_params.get("sid")
+    state = get_store().load_session(sid) if sid else None
+    if state is None:
+        sid = ulid()
+        st.query_params["sid"] = sid
+    else:
+        st.session_state.update(state, cart=dict(state['cart']))
+        st.session_state.saved_session = state
+    st.session_state.sid = sid
+
+def save_session():
+    # Written only when one of the shared keys changed during this rerun;
+    # the cart goes as pairs because JSON object keys are strings
+    state = {key: st.session_state[key] for key in SHARED_SESSION_KEYS}
+    state['cart'] = [list(line) for line in state['cart'].items()]
+    if st.session_state.get("saved_session") != state:
+        get_store().save_session(st.session_state.sid, state)
+        st.session_state.saved_session = state
+
+def sync_changes():
+    # Fragments rerun without main(), so they pick up other processes'
+    # writes themselves
+    if MULTI_PROCESS:
+        get_store().sync()
+
+def show_metrics_panel():
+    # Admins open the app with ?admin=<PANAMA_ADMIN_TOKEN> while PANAMA_METRICS is on
+    token = os.environ.get("PANAMA_ADMIN_TOKEN")
+    # Compared as bytes: compare_digest rejects str with non-ASCII characters
+    supplied = st.query_params.get("admin", "")
+    if not METRICS.enabled or not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+        return
+    with st.sidebar.expander("Performance"):
+        st.caption("Slowest sections of recent reruns")
+        st.dataframe(METRICS.slowest(), hide_index=True)
+        st.caption("All sections")
+        st.dataframe(METRICS.summary(), hide_index=True)
+        st.caption("Filter result cache")
+        st.dataframe([get_query_cache().stats()], hide_index=True)
 
 def show_role_selection():
     st.header("Welcome to Panama Construction Platform")
@@ -105,8 +383,15 @@ def show_role_selection():
         if st.button("Contractor"):
             st.session_state.role = "Contractor"
     with col3:
+        company = st.text_input("Company Name", key="company_name").strip()
         if st.button("Supplier"):
-            st.session_state.role = "Supplier"
+            if not company:
+                st.error("Enter your company name to continue as a supplier")
+            elif not get_store().claim_supplier(company, st.session_state.user_id):
+                st.error(f"{company} is already registered to another account")
+            else:
+                st.session_state.company = company
+                st.session_state.role = "Supplier"
 
     # Instructions for each role
     with col1:
@@ -119,6 +404,7 @@ def show_role_selection():
 def reset_role():
     st.session_state.role = None
 
+@METRICS.timed
 def show_developer_interface():
     st.sidebar.button("← Back to Role Selection", on_click=reset_role)
     st.header("Developer Dashboard")
@@ -128,87 +414,157 @@ def show_developer_interface():
     with tab2:
         create_my_projects_tab()
 
+def file_data(file_info):
+    # Download bytes are only read when the button is clicked
+    read = get_store().blobs.reader(file_info['sha256'])
+
+    def timed_read():
+        with METRICS.section("file_read"):
+            return read()
+    return timed_read
+
+def show_files(record):
+    # Previews and downloads for a project's or bid's files
+    if record.files_status == FileStatus.PROCESSING:
+        st.info("Files are still being processed")
+    for file_info in record.files:
+        if file_info['error']:
+            st.write(f"{file_info['name']} (not accepted: {file_info['error']})")
+            continue
+        if file_info['thumbnail']:
+            st.image(get_store().blobs.read(file_info['thumbnail']), width=160)
+        st.download_button(label=file_info['name'], data=file_data(file_info),
+                           file_name=file_info['name'], mime=file_info['type'])
+
+def has_files(record):
+    return bool(record.files) or record.files_status == FileStatus.PROCESSING
+
+@METRICS.timed
 def create_post_project_tab():
     st.subheader("Post New Project")
     with st.form("post_project_form"):
         title = st.text_input("Project Title:*")
         location = st.text_input("Location:*")
-        project_type = st.selectbox("Project Type:*", [
-                "High-rise Residential",
-                "Commercial Office",
-                "Commercial Retail",
-                "Industrial",
-                "Healthcare",
-                "Infrastructure",
-                "Renovation"
-            ])
+        project_type = st.selectbox("Project Type:*", reference_data().project_types)
         budget = st.text_input("Budget (USD):*")
         description = st.text_area("Description:*")
-        uploaded_files = st.file_uploader("Upload Project Files", accept_multiple_files=True)
+        uploaded_files = st.file_uploader("Upload Project Files", accept_multiple_files=True,
+                                          type=sorted(ALLOWED_EXTENSIONS))
         submitted = st.form_submit_button("Submit Project")
         if submitted:
             if not all([title, location, project_type, budget, description]):
                 st.error("Please fill in all required fields")
             else:
                 try:
-                    budget = float(budget)
-                    project_files = []
-                    for uploaded_file in uploaded_files:
-                        file_data = uploaded_file.read()
-                        file_info = {
-                            'name': uploaded_file.name,
-                            'data': file_data,
-                            'type': uploaded_file.type
-                        }
-                        project_files.append(file_info)
-                    new_project = {
-                        "title": title,
-                        "location": location,
-                        "type": project_type,
-                        "budget": budget,
-                        "description": description,
-                        "status": "Open",
-                        "date_posted": datetime.datetime.now().strftime("%Y-%m-%d"),
-                        "files": project_files,
-                        "bids": []
-                    }
-                    st.session_state.projects.append(new_project)
+                    budget_cents = to_cents(float(budget))
+                    new_project = Project(
+                        title=title,
+                        location=location,
+                        type=project_type,
+                        budget_cents=budget_cents,
+                        description=description,
+                        status=ProjectStatus.OPEN,
+                        posted_at=now_ts(),
+                        files_status=FileStatus.PROCESSING if uploaded_files else FileStatus.READY,
+                        user_id=st.session_state.user_id
+                    )
+                    project_id = get_store().add_project(new_project)
+                    # Files are stored and previewed in the background
+                    if uploaded_files:
+                        get_upload_pipeline().submit("project", project_id, uploaded_files)
                     st.success("Project posted successfully!")
                 except ValueError:
                     st.error("Please enter a valid budget amount")
 
+def ranked_bids(project, weights):
+    # Shared across sessions until a bid or project is written
+    return get_query_cache().get_or_compute("bid_ranking", ("bids", "projects"), (project.id, weights),
+                                            lambda: rank_bids(project.bids, project.budget_cents, weights))
+
+def show_bid_comparison(project, weights):
+    quartiles = timeline_quartiles(project.bids)
+    st.caption(f"Timeline quartiles: {quartiles[0]:.0f} / {quartiles[1]:.0f} / {quartiles[2]:.0f} days")
+    st.dataframe([{
+        "Rank": row['rank'],
+        "Contractor": row['bid'].contractor,
+        "Amount": format_money(row['bid'].amount_cents),
+        "% of Budget": round(row['budget_ratio'] * 100, 1),
+        "Timeline (days)": row['bid'].timeline,
+        "Timeline Percentile": round(row['timeline_percentile']),
+        "Score": round(row['score'], 3),
+        "Flags": ", ".join(row['flags'])
+    } for row in ranked_bids(project, weights)], hide_index=True)
+
+def show_developer_kpis():
+    # Reads the per-type rollups only; never the projects or bids themselves
+    totals = get_store().project_type_totals(st.session_state.user_id)
+    bids = sum(row['bids'] for row in totals)
+    bid_total = sum(row['bid_total_cents'] for row in totals)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Projects", sum(row['projects'] for row in totals))
+    col2.metric("Bids Received", bids)
+    col3.metric("Average Bid", format_money(bid_total // bids) if bids else "-")
+    with st.expander("Bids by Project Type"):
+        st.dataframe([{
+            "Type": row['type'],
+            "Projects": row['projects'],
+            "Bids": row['bids'],
+            "Average Bid": format_money(row['bid_total_cents'] // row['bids']) if row['bids'] else "-"
+        } for row in totals], hide_index=True)
+
+@METRICS.timed
 def create_my_projects_tab():
     st.subheader("My Projects")
-    projects = st.session_state.projects
+    show_developer_kpis()
+    price_weight = st.slider("Bid ranking: weight on price vs. timeline", 0.0, 1.0, dict(DEFAULT_WEIGHTS)['price'],
+                             step=0.05)
+    weights = (("price", price_weight), ("timeline", round(1 - price_weight, 2)))
+    show_my_projects(weights)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@METRICS.timed
+def show_my_projects(weights):
+    # Refreshes on its own when this developer's projects or their bids change
+    # in any session
+    sync_changes()
+    user_id = st.session_state.user_id
+    topics = (f"projects:{user_id}", f"bids:{user_id}")
+    announce("my_projects_seen", (f"bids:{user_id}",), "New bids received")
+    store = get_store()
+    ids = live_query("my_projects_ids", topics, (), lambda: store.list_ids('projects', user_id=user_id))
+    page_ids = tuple(paginate(ids, "my_projects_page"))
+    projects, bid_totals = live_query("my_projects_rows", topics, page_ids,
+                                      lambda: (store.list_projects(page_ids), store.bid_totals(page_ids)))
     if projects:
         for project in projects:
-            with st.expander(project['title']):
-                st.write(f"**Location:** {project['location']}")
-                st.write(f"**Type:** {project['type']}")
-                st.write(f"**Budget:** ${project['budget']:,.2f}")
-                st.write(f"**Status:** {project['status']}")
-                st.write(f"**Posted on:** {project['date_posted']}")
-                st.write(f"**Description:** {project['description']}")
-                if project['files']:
+            with st.expander(project.title):
+                st.write(f"**Location:** {project.location}")
+                st.write(f"**Type:** {project.type}")
+                st.write(f"**Budget:** {format_money(project.budget_cents)}")
+                st.write(f"**Status:** {project.status}")
+                st.write(f"**Posted on:** {format_date(project.posted_at)}")
+                st.write(f"**Description:** {project.description}")
+                if has_files(project):
                     st.write("**Files:**")
-                    for file_info in project['files']:
-                        st.download_button(label=file_info['name'], data=file_info['data'],
-                                           file_name=file_info['name'])
+                    show_files(project)
                 else:
                     st.write("No files uploaded")
-                if project['bids']:
-                    st.write(f"**Bids Received:** {len(project['bids'])}")
-                    for bid in project['bids']:
-                        st.write(f"- {bid['contractor']}: ${bid['amount']:,.2f}, Timeline: {bid['timeline']} days")
+                if project.bids:
+                    totals = bid_totals[project.id]
+                    st.write(f"**Bids Received:** {totals['bids']} (lowest {format_money(totals['min_cents'])}, "
+                             f"average {format_money(totals['total_cents'] // totals['bids'])})")
+                    show_bid_comparison(project, weights)
                 else:
                     st.write("No bids received yet")
     else:
         st.write("You have no projects")
 
+@METRICS.timed
 def show_contractor_interface():
     st.sidebar.button("← Back to Role Selection", on_click=reset_role)
     st.header("Contractor Dashboard")
-    tab1, tab2, tab3, tab4 = st.tabs(["Available Projects", "My Bids", "Materials Search", "My Orders"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Available Projects", "My Bids", "Materials Search",
+                                            f"Cart ({len(st.session_state.cart)})", "My Orders"])
     with tab1:
         create_available_projects_tab()
     with tab2:
@@ -216,267 +572,454 @@ def show_contractor_interface():
     with tab3:
         create_materials_search_tab()
     with tab4:
+        create_cart_tab()
+    with tab5:
         create_orders_tab()
 
+@METRICS.timed
 def create_available_projects_tab():
     st.subheader("Available Projects")
-    search_text = st.text_input("Search")
-    selected_location = st.selectbox("Location", ['All', 'Panama City', 'Costa del Este', 'Obarrio', 
-                        'San Francisco', 'Punta Pacifica', 'Clayton', 'Other'])
-    selected_type = st.selectbox("Project Type", [
-        "All",
-        "High-rise Residential",
-        "Commercial Office",
-        "Commercial Retail",
-        "Industrial",
-        "Healthcare",
-        "Infrastructure",
-        "Renovation"
-    ])
+    if st.radio("Show", ["All Projects", "Recommended for You"], horizontal=True,
+                key="project_view") == "Recommended for You":
+        show_recommended_projects()
+        return
+    search_text = st.text_input("Search", key="project_search")
+    facets = get_project_facets()
+    reference = reference_data()
+    selected_location = st.selectbox("Location", reference.project_location_filter,
+                                     format_func=with_count(facets.counts('location')), key="project_location")
+    selected_type = st.selectbox("Project Type", reference.project_type_filter,
+                                 format_func=with_count(facets.counts('type')), key="project_type")
     min_budget = st.text_input("Min Budget (USD)")
     max_budget = st.text_input("Max Budget (USD)")
-    projects = st.session_state.projects
-    filtered_projects = []
     try:
-        min_budget = float(min_budget) if min_budget else 0
-        max_budget = float(max_budget) if max_budget else float('inf')
+        min_budget = to_cents(float(min_budget)) if min_budget else None
+        max_budget = to_cents(float(max_budget)) if max_budget else None
     except ValueError:
         st.error("Please enter valid budget amounts")
         return
-    for project in projects:
-        if search_text.lower() not in project['title'].lower():
-            continue
-        if selected_location != 'All' and project['location'] != selected_location:
-            continue
-        if selected_type != 'All' and project['type'] != selected_type:
-            continue
-        if not (min_budget <= project['budget'] <= max_budget):
-            continue
-        filtered_projects.append(project)
+    filters = (selected_location, selected_type, min_budget, max_budget)
+    ids = cached_ids("projects", "projects", find_project_ids, search_text, *filters)
+    filtered_projects = get_store().list_projects(paginate(ids, "projects_page", (search_text,) + filters))
     if filtered_projects:
         for project in filtered_projects:
-            with st.expander(project['title']):
-                st.write(f"**Location:** {project['location']}")
-                st.write(f"**Type:** {project['type']}")
-                st.write(f"**Budget:** ${project['budget']:,.2f}")
-                st.write(f"**Status:** {project['status']}")
-                st.write(f"**Posted on:** {project['date_posted']}")
-                st.write(f"**Description:** {project['description']}")
-                if project['files']:
-                    st.write("**Files:**")
-                    for file_info in project['files']:
-                        st.download_button(label=file_info['name'], data=file_info['data'],
-                                           file_name=file_info['name'])
-                else:
-                    st.write("No files uploaded")
-                st.write("### Submit Bid")
-                with st.form(f"bid_form_{project['title']}"):
-                    amount = st.text_input("Bid Amount ($):*")
-                    timeline = st.text_input("Timeline (days):*")
-                    company = st.text_input("Company Name:*")
-                    contact = st.text_input("Contact Person:*")
-                    phone = st.text_input("Phone:*")
-                    email = st.text_input("Email:*")
-                    license = st.text_input("License Number:*")
-                    approach = st.text_area("Project Approach:*")
-                    experience = st.text_area("Similar Projects Experience:*")
-                    bid_files = st.file_uploader("Upload Supporting Documents", accept_multiple_files=True)
-                    submitted = st.form_submit_button("Submit Bid")
-                    if submitted:
-                        if not all([amount, timeline, company, contact, phone, email, license, approach, experience]):
-                            st.error("Please fill in all required fields")
-                        else:
-                            try:
-                                amount = float(amount)
-                                timeline = int(timeline)
-                                if amount > project['budget'] * 1.2:
-                                    st.warning("Your bid is significantly over the project budget.")
-                                bid_files_list = []
-                                for uploaded_file in bid_files:
-                                    file_data = uploaded_file.read()
-                                    file_info = {
-                                        'name': uploaded_file.name,
-                                        'data': file_data,
-                                        'type': uploaded_file.type
-                                    }
-                                    bid_files_list.append(file_info)
-                                new_bid = {
-                                    "amount": amount,
-                                    "timeline": timeline,
-                                    "contractor": company,
-                                    "contact": contact,
-                                    "phone": phone,
-                                    "email": email,
-                                    "license": license,
-                                    "approach": approach,
-                                    "experience": experience,
-                                    "files": bid_files_list,
-                                    "date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                                    "status": "Submitted",
-                                    "status_history": [{
-                                        "status": "Submitted",
-                                        "date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                                        "notes": "Bid submitted successfully"
-                                    }],
-                                    "user_id": st.session_state.user_id  # To associate bid with user
-                                }
-                                project['bids'].append(new_bid)
-                                st.success("Bid submitted successfully!")
-                            except ValueError:
-                                st.error("Please enter valid numbers for amount and timeline")
+            show_project(project)
     else:
         st.write("No projects found matching the criteria")
 
+def show_recommended_projects():
+    # Kept up to date by the matcher as projects and bids come in; reading
+    # them is a lookup
+    recommended = dict(get_tender_matcher().recommended(st.session_state.user_id))
+    if not recommended:
+        st.write("Submit a bid and projects like the ones you bid on will be recommended here")
+        return
+    st.caption("Open projects ranked by how closely they match the type, location, size and wording of your bids")
+    for project in get_store().list_projects(list(recommended)):
+        show_project(project, f"{recommended[project.id]:.0%} match")
+
+def show_project(project, match=None):
+    with st.expander(project.title if match is None else f"{project.title} · {match}"):
+        st.write(f"**Location:** {project.location}")
+        st.write(f"**Type:** {project.type}")
+        st.write(f"**Budget:** {format_money(project.budget_cents)}")
+        st.write(f"**Status:** {project.status}")
+        st.write(f"**Posted on:** {format_date(project.posted_at)}")
+        st.write(f"**Description:** {project.description}")
+        if has_files(project):
+            st.write("**Files:**")
+            show_files(project)
+        else:
+            st.write("No files uploaded")
+        # Forms are only built for records the user has opened
+        if st.toggle("Submit a Bid", key=f"bid_open_{project.id}"):
+            show_bid_form(project)
+
+def show_bid_form(project):
+    st.write("### Submit Bid")
+    with st.form(f"bid_form_{project.id}"):
+        amount = st.text_input("Bid Amount ($):*")
+        timeline = st.text_input("Timeline (days):*")
+        company = st.text_input("Company Name:*")
+        contact = st.text_input("Contact Person:*")
+        phone = st.text_input("Phone:*")
+        email = st.text_input("Email:*")
+        license = st.text_input("License Number:*")
+        approach = st.text_area("Project Approach:*")
+        experience = st.text_area("Similar Projects Experience:*")
+        bid_files = st.file_uploader("Upload Supporting Documents", accept_multiple_files=True,
+                                     type=sorted(ALLOWED_EXTENSIONS))
+        submitted = st.form_submit_button("Submit Bid")
+        if submitted:
+            if not all([amount, timeline, company, contact, phone, email, license, approach, experience]):
+                st.error("Please fill in all required fields")
+            else:
+                try:
+                    amount_cents = to_cents(float(amount))
+                    timeline = int(timeline)
+                    if amount_cents > project.budget_cents * 1.2:
+                        st.warning("Your bid is significantly over the project budget.")
+                    submitted_at = now_ts()
+                    new_bid = Bid(
+                        amount_cents=amount_cents,
+                        timeline=timeline,
+                        contractor=company,
+                        contact=contact,
+                        phone=phone,
+                        email=email,
+                        license=license,
+                        approach=approach,
+                        experience=experience,
+                        files_status=FileStatus.PROCESSING if bid_files else FileStatus.READY,
+                        submitted_at=submitted_at,
+                        status=BidStatus.SUBMITTED,
+                        status_history=[{
+                            "status": BidStatus.SUBMITTED,
+                            "at": submitted_at,
+                            "notes": "Bid submitted successfully"
+                        }],
+                        user_id=st.session_state.user_id  # To associate bid with user
+                    )
+                    bid_id = get_store().add_bid(project.id, new_bid)
+                    if bid_files:
+                        get_upload_pipeline().submit("bid", bid_id, bid_files)
+                    st.success("Bid submitted successfully!")
+                except ValueError:
+                    st.error("Please enter valid numbers for amount and timeline")
+
+@METRICS.timed
 def create_my_bids_tab():
     st.subheader("My Bids")
-    status_filter = st.selectbox("Status", ['All', 'Submitted', 'Under Review', 'Awarded', 'Not Selected', 'Pending'])
-    bids = []
-    for project in st.session_state.projects:
-        for bid in project.get('bids', []):
-            if bid.get('user_id') == st.session_state.user_id:
-                bids.append({
-                    'project_title': project['title'],
-                    'location': project['location'],
-                    'amount': bid['amount'],
-                    'timeline': bid['timeline'],
-                    'date': bid['date'],
-                    'status': bid['status'],
-                    'notes': bid.get('notes', ''),
-                    'approach': bid.get('approach', ''),
-                    'experience': bid.get('experience', ''),
-                    'files': bid.get('files', [])
-                })
-    filtered_bids = [bid for bid in bids if status_filter == 'All' or bid['status'] == status_filter]
+    status_filter = st.selectbox("Status", ['All'] + list(BidStatus))
+    # The user_id index keeps this proportional to the user's own bids
+    store = get_store()
+    ids = store.list_ids('bids', user_id=st.session_state.user_id, **facet_filters(status=status_filter))
+    filtered_bids = store.list_bids(paginate(ids, "my_bids_page", (status_filter,)))
     if filtered_bids:
         for bid in filtered_bids:
-            with st.expander(f"Bid for {bid['project_title']}"):
-                st.write(f"**Project:** {bid['project_title']}")
-                st.write(f"**Location:** {bid['location']}")
-                st.write(f"**Amount:** ${bid['amount']:,.2f}")
-                st.write(f"**Timeline:** {bid['timeline']} days")
-                st.write(f"**Date:** {bid['date']}")
-                st.write(f"**Status:** {bid['status']}")
-                st.write(f"**Notes:** {bid['notes']}")
-                st.write(f"**Project Approach:** {bid['approach']}")
-                st.write(f"**Experience:** {bid['experience']}")
-                if bid['files']:
+            with st.expander(f"Bid for {bid.project_title}"):
+                st.write(f"**Project:** {bid.project_title}")
+                st.write(f"**Location:** {bid.project_location}")
+                st.write(f"**Amount:** {format_money(bid.amount_cents)}")
+                st.write(f"**Timeline:** {bid.timeline} days")
+                st.write(f"**Date:** {format_date(bid.submitted_at)}")
+                st.write(f"**Status:** {bid.status}")
+                st.write(f"**Notes:** {bid.get('notes', '')}")
+                st.write(f"**Project Approach:** {bid.approach}")
+                st.write(f"**Experience:** {bid.experience}")
+                if has_files(bid):
                     st.write("**Supporting Documents:**")
-                    for file_info in bid['files']:
-                        st.download_button(label=file_info['name'], data=file_info['data'],
-                                           file_name=file_info['name'])
+                    show_files(bid)
     else:
         st.write("No bids found")
 
+@METRICS.timed
 def create_materials_search_tab():
     st.subheader("Materials Search")
-    search_text = st.text_input("Search")
-    category = st.selectbox("Category", ['All Categories'] + list(st.session_state.categories.keys()))
+    search_text = st.text_input("Search", key="material_search")
+    facets = get_material_facets()
+    reference = reference_data()
+    category = st.selectbox("Category", reference.category_filter,
+                            format_func=with_count(facets.counts('category')), key="material_category")
     subcategory = 'All'
     if category != 'All Categories':
-        subcategories = st.session_state.categories.get(category, [])
-        subcategory = st.selectbox("Subcategory", ['All'] + subcategories)
-    location = st.selectbox("Location", ['All', 'Panama City', 'Costa del Este', 'Obarrio', 
-                                      'San Francisco', 'Punta Pacifica', 'Clayton'])
-    availability = st.selectbox("Availability", ['All', 'In Stock', 'Limited Stock', 'Out of Stock'])
+        subcategories = reference.categories.get(category, ())
+        subcategory = st.selectbox("Subcategory", ('All',) + subcategories,
+                                   format_func=with_count(facets.counts('subcategory')), key="material_subcategory")
+    location = st.selectbox("Location", reference.material_location_filter,
+                            format_func=with_count(facets.counts('location')), key="material_location")
+    availability = st.selectbox("Availability", reference.availability_filter,
+                                format_func=with_count(facets.counts('availability')), key="material_availability")
     min_price = st.text_input("Min Price (USD)")
     max_price = st.text_input("Max Price (USD)")
-    materials = st.session_state.materials
-    filtered_materials = []
+    site = st.text_input("Project Site", key="material_site", placeholder="e.g. Calle 50, Bella Vista")
+    near = None
+    if site:
+        place = geocode(site)
+        if place is None:
+            st.warning("That place is not in our list of Panamanian locations; showing materials from everywhere")
+        else:
+            radius = st.slider("Within (km)", 1, 100, 10, key="material_radius")
+            st.caption(f"Nearest first from {place.name}, {place.province}")
+            near = (place.latitude, place.longitude, radius)
     try:
-        min_price = float(min_price) if min_price else 0
-        max_price = float(max_price) if max_price else float('inf')
+        min_price = to_cents(float(min_price)) if min_price else None
+        max_price = to_cents(float(max_price)) if max_price else None
     except ValueError:
         st.error("Please enter valid price amounts")
         return
-    for material in materials:
-        if search_text.lower() not in material['name'].lower():
-            continue
-        if category != 'All Categories' and material['category'] != category:
-            continue
-        if subcategory != 'All' and material['subcategory'] != subcategory:
-            continue
-        if location != 'All' and material['location'] != location:
-            continue
-        if availability != 'All' and material['availability'] != availability:
-            continue
-        if not (min_price <= material['price'] <= max_price):
-            continue
-        filtered_materials.append(material)
+    filters = (category, subcategory, location, availability, min_price, max_price, near)
+    ids = cached_ids("materials", "materials", find_material_ids, search_text, *filters)
+    filtered_materials = get_store().list_materials(paginate(ids, "materials_page", (search_text,) + filters))
+    trends = price_trends([material.id for material in filtered_materials])
     if filtered_materials:
         for material in filtered_materials:
-            with st.expander(material['name']):
-                st.write(f"**Category:** {material['category']} - {material['subcategory']}")
-                st.write(f"**Price:** ${material['price']:.2f}")
-                st.write(f"**Supplier:** {material['supplier']}")
-                st.write(f"**Location:** {material['location']}")
-                st.write(f"**Availability:** {material['availability']}")
-                st.write(f"**Minimum Order:** {material['minimum_order']}")
-                st.write("### Place Order")
-                with st.form(f"order_form_{material['name']}"):
-                    quantity = st.text_input("Quantity:*", value=str(material['minimum_order']))
-                    delivery_date = st.date_input("Delivery Date:*", min_value=datetime.datetime.now().date())
-                    delivery_address = st.text_area("Delivery Address:*")
-                    project_name = st.text_input("Project Name:*")
-                    instructions = st.text_area("Special Instructions:")
-                    contact_person = st.text_input("Contact Person:*")
-                    contact_phone = st.text_input("Contact Phone:*")
-                    submitted = st.form_submit_button("Place Order")
-                    if submitted:
-                        if not all([quantity, delivery_date, delivery_address, project_name, contact_person, contact_phone]):
-                            st.error("Please fill in all required fields")
-                        else:
-                            try:
-                                quantity = int(quantity)
-                                if quantity < material['minimum_order']:
-                                    st.error(f"Minimum order quantity is {material['minimum_order']}")
-                                    return
-                                new_order = {
-                                    "order_id": f"ORD-{len(st.session_state.orders) + 1:04d}",
-                                    "material": material['name'],
-                                    "supplier": material['supplier'],
-                                    "quantity": quantity,
-                                    "price_per_unit": material['price'],
-                                    "total_price": quantity * material['price'],
-                                    "delivery_date": delivery_date.strftime("%Y-%m-%d"),
-                                    "delivery_address": delivery_address,
-                                    "project_name": project_name,
-                                    "instructions": instructions,
-                                    "status": "Pending",
-                                    "order_date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                                    "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                    "contact_person": contact_person,
-                                    "contact_phone": contact_phone,
-                                    "user_id": st.session_state.user_id  # Associate order with user
-                                }
-                                st.session_state.orders.append(new_order)
-                                st.success(f"Order placed successfully!\nOrder ID: {new_order['order_id']}")
-                            except ValueError:
-                                st.error("Please enter a valid quantity")
+            with st.expander(material.name):
+                st.write(f"**Category:** {material.category} - {material.subcategory}")
+                st.write(f"**Price:** {format_money(material.price_cents)}")
+                st.caption(f"{TREND_WEEKS}-week trend: {sparkline(trends[material.id])} "
+                           f"{format_trend_change(trends[material.id])}")
+                st.write(f"**Supplier:** {material.supplier}")
+                st.write(f"**Location:** {material.location}")
+                if near is not None and material.latitude is not None:
+                    distance = haversine_km(near[0], near[1], material.latitude, material.longitude)
+                    st.write(f"**Distance:** {distance:.1f} km")
+                st.write(f"**Availability:** {format_availability(material)}")
+                st.write(f"**Minimum Order:** {material.minimum_order}")
+                if st.toggle("Price History", key=f"price_history_{material.id}"):
+                    show_price_history(material)
+                if not can_order(material):
+                    continue
+                if st.toggle("Add to Cart", key=f"cart_open_{material.id}"):
+                    show_add_to_cart(material)
+                if st.toggle("Place an Order", key=f"order_open_{material.id}"):
+                    show_order_form(material)
     else:
         st.write("No materials found matching the criteria")
 
+def price_trends(material_ids):
+    # Weekly averages from the price rollups, one query per page of results
+    # and shared by every session until a material is written to
+    week = bucket_start(now_ts(), "week")
+    return get_query_cache().get_or_compute(
+        "price_trends", ("materials",), (tuple(material_ids), week),
+        lambda: {material_id: trend(rows, "week", TREND_WEEKS, week)
+                 for material_id, rows in get_store().price_rollups(material_ids, "week").items()})
+
+def format_trend_change(values):
+    known = [value for value in values if value is not None]
+    if len(known) < 2 or not known[0]:
+        return ""
+    return f"({(known[-1] - known[0]) / known[0]:+.1%})"
+
+def show_price_history(material):
+    col1, col2 = st.columns(2)
+    period = col1.radio("Group by", list(PERIODS), format_func=str.title, horizontal=True,
+                        key=f"price_period_{material.id}")
+    days = HISTORY_RANGES[col2.selectbox("Range", list(HISTORY_RANGES), key=f"price_range_{material.id}")]
+    store = get_store()
+    # Reads only the buckets in range, never the full series
+    rows = store.price_rollups([material.id], period, bucket_start(now_ts() - days * DAY, period))[material.id]
+    if rows:
+        st.line_chart([{
+            "Date": format_date(row['start']),
+            "Min": from_cents(row['min_cents']),
+            "Average": round(from_cents(row['total_cents']) / row['points'], 2),
+            "Max": from_cents(row['max_cents'])
+        } for row in rows], x="Date", y=["Min", "Average", "Max"])
+    else:
+        st.write(f"No price changes in this range; the price has been {format_money(material.price_cents)} throughout")
+    # The same material from other suppliers, side by side
+    same_name = store.list_ids('materials', name=material.name)
+    if len(same_name) > 1:
+        trends = price_trends(same_name)
+        st.write("**Other Suppliers:**")
+        st.dataframe([{
+            "Supplier": other.supplier,
+            "Price": format_money(other.price_cents),
+            f"{TREND_WEEKS}-week Trend": sparkline(trends[other.id]),
+            "Change": format_trend_change(trends[other.id])
+        } for other in store.list_materials(same_name) if other.id != material.id], hide_index=True)
+
+def format_availability(material):
+    if material.stock is None:
+        return material.availability
+    return f"{material.availability} ({material.stock:,} units)"
+
+def can_order(material):
+    # Stock is checked again when the order is written; this only spares
+    # the contractor a form that cannot succeed
+    return material.stock is None or material.stock >= (material.minimum_order or 1)
+
+def show_order_form(material):
+    st.write("### Place Order")
+    with st.form(f"order_form_{material.id}"):
+        quantity = st.text_input("Quantity:*", value=str(material.minimum_order))
+        delivery = delivery_inputs()
+        submitted = st.form_submit_button("Place Order")
+        if submitted:
+            if not quantity or not all(delivery[field] for field in DELIVERY_REQUIRED):
+                st.error("Please fill in all required fields")
+            else:
+                try:
+                    quantity = int(quantity)
+                except ValueError:
+                    st.error("Please enter a valid quantity")
+                    return
+                if quantity < material.minimum_order:
+                    st.error(f"Minimum order quantity is {material.minimum_order}")
+                    return
+                try:
+                    order_id = get_store().add_order(build_order(material, quantity, delivery))
+                except ValueError as error:
+                    # Another order took the units since this page was drawn
+                    st.error(str(error))
+                    return
+                st.success(f"Order placed successfully!\nOrder ID: {order_id}")
+
+DELIVERY_REQUIRED = ("delivery_date", "delivery_address", "project_name", "contact_person", "contact_phone")
+
+def delivery_inputs():
+    # Delivery details, asked once per order form or once per checkout
+    return {
+        "delivery_date": st.date_input("Delivery Date:*", min_value=datetime.datetime.now().date()),
+        "delivery_address": st.text_area("Delivery Address:*", value=st.session_state.get("material_site", "")),
+        "project_name": st.text_input("Project Name:*"),
+        "instructions": st.text_area("Special Instructions:"),
+        "contact_person": st.text_input("Contact Person:*"),
+        "contact_phone": st.text_input("Contact Phone:*")
+    }
+
+def build_order(material, quantity, delivery):
+    ordered_at = now_ts()
+    return Order(
+        material=material.name,
+        material_id=material.id,
+        supplier=material.supplier,
+        quantity=quantity,
+        price_per_unit_cents=material.price_cents,
+        total_cents=quantity * material.price_cents,
+        delivery_at=date_to_ts(delivery['delivery_date']),
+        delivery_address=delivery['delivery_address'],
+        project_name=delivery['project_name'],
+        instructions=delivery['instructions'],
+        status=OrderStatus.PENDING,
+        ordered_at=ordered_at,
+        updated_at=ordered_at,
+        contact_person=delivery['contact_person'],
+        contact_phone=delivery['contact_phone'],
+        user_id=st.session_state.user_id  # Associate order with user
+    )
+
+def show_add_to_cart(material):
+    # A form, so choosing the quantity does not rerun the page; only the
+    # add itself does
+    with st.form(f"cart_form_{material.id}", border=False):
+        col1, col2 = st.columns([2, 1], vertical_alignment="bottom")
+        minimum = material.minimum_order or 1
+        quantity = max(st.session_state.cart.get(material.id, 0), minimum)
+        if material.stock is not None:
+            quantity = min(quantity, material.stock)
+        col1.number_input("Quantity", min_value=minimum, max_value=material.stock, step=1, value=quantity,
+                          key=f"cart_quantity_{material.id}")
+        col2.form_submit_button("Add", on_click=add_to_cart, args=(material.id,))
+
+def add_to_cart(material_id):
+    st.session_state.cart[material_id] = int(st.session_state[f"cart_quantity_{material_id}"])
+    st.toast("Added to cart")
+
+def empty_cart():
+    st.session_state.cart.clear()
+
+def check_cart(materials, quantities):
+    # Every line checked in one pass, so all problems are reported together
+    errors = []
+    for material_id, quantity in quantities.items():
+        material = materials[material_id]
+        if quantity < (material.minimum_order or 1):
+            errors.append(f"{material.name} ({material.supplier}): minimum order quantity is "
+                          f"{material.minimum_order}")
+        elif material.stock is not None and quantity > material.stock:
+            errors.append(f"{material.name} ({material.supplier}): only {material.stock:,} units left in stock")
+    return errors
+
+@METRICS.timed
+def create_cart_tab():
+    st.subheader("Cart")
+    cart = st.session_state.cart
+    materials = {material.id: material for material in get_store().list_materials(list(cart))}
+    if len(materials) < len(cart):
+        for material_id in [material_id for material_id in cart if material_id not in materials]:
+            del cart[material_id]
+        st.warning("Materials that are no longer listed were removed from your cart")
+    if not cart:
+        st.write("Your cart is empty. Add materials from Materials Search.")
+        return
+    material_ids = list(cart)
+    with st.form("checkout_form"):
+        # Quantity edits and removals stay in the browser until checkout
+        lines = st.data_editor([{
+            "Material": materials[material_id].name,
+            "Supplier": materials[material_id].supplier,
+            "Unit Price": format_money(materials[material_id].price_cents),
+            "Minimum": materials[material_id].minimum_order,
+            "In Stock": materials[material_id].stock,
+            "Quantity": cart[material_id],
+            "Remove": False
+        } for material_id in material_ids], column_config={
+            "Quantity": st.column_config.NumberColumn(min_value=1, step=1, required=True),
+            "Remove": st.column_config.CheckboxColumn()
+        }, disabled=["Material", "Supplier", "Unit Price", "Minimum", "In Stock"], hide_index=True, key="cart_lines")
+        total = sum(materials[material_id].price_cents * quantity for material_id, quantity in cart.items())
+        st.write(f"**Total before edits:** {format_money(total)}")
+        delivery = delivery_inputs()
+        submitted = st.form_submit_button("Place Orders")
+    st.button("Empty Cart", on_click=empty_cart)
+    if not submitted:
+        return
+    quantities = {material_id: int(line["Quantity"])
+                  for material_id, line in zip(material_ids, lines) if not line["Remove"]}
+    # The cart keeps the edits even if checkout is refused
+    cart.clear()
+    cart.update(quantities)
+    errors = check_cart(materials, quantities)
+    if not quantities:
+        errors.append("Your cart is empty")
+    if not all(delivery[field] for field in DELIVERY_REQUIRED):
+        errors.append("Please fill in all required delivery fields")
+    if errors:
+        st.error("\n\n".join(errors))
+        return
+    orders = [build_order(materials[material_id], quantity, delivery) for material_id, quantity in quantities.items()]
+    try:
+        purchase_orders = get_store().add_purchase_orders(orders)
+    except ValueError as error:
+        # Stock ran out since the cart was checked; nothing was ordered
+        st.error(str(error))
+        return
+    cart.clear()
+    st.success(f"{len(orders)} orders placed successfully!\n\n" + "\n\n".join(
+        f"{purchase_order} ({supplier}): {', '.join(order_ids)}"
+        for supplier, (purchase_order, order_ids) in purchase_orders.items()))
+
+@METRICS.timed
 def create_orders_tab():
     st.subheader("My Orders")
-    status_filter = st.selectbox("Status", ['All', 'Pending', 'Confirmed', 'In Transit', 'Delivered', 'Cancelled'])
-    orders = [order for order in st.session_state.orders if order.get('user_id') == st.session_state.user_id]
-    filtered_orders = [order for order in orders if status_filter == 'All' or order['status'] == status_filter]
+    status_filter = st.selectbox("Status", ['All'] + list(OrderStatus))
+    show_my_orders(status_filter)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@METRICS.timed
+def show_my_orders(status_filter):
+    # Picks up status changes made by suppliers in other sessions
+    sync_changes()
+    topics = (f"orders:{st.session_state.user_id}",)
+    announce("my_orders_seen", topics, "Your orders were updated")
+    store = get_store()
+    ids = live_query("my_orders_ids", topics, (status_filter,), lambda: store.list_ids(
+        'orders', user_id=st.session_state.user_id, **facet_filters(status=status_filter)))
+    page_ids = tuple(paginate(ids, "my_orders_page", (status_filter,)))
+    filtered_orders = live_query("my_orders_rows", topics, page_ids, lambda: store.list_orders(page_ids))
     if filtered_orders:
         for order in filtered_orders:
-            with st.expander(f"Order {order['order_id']} - {order['material']}"):
-                st.write(f"**Order ID:** {order['order_id']}")
-                st.write(f"**Material:** {order['material']}")
-                st.write(f"**Quantity:** {order['quantity']}")
-                st.write(f"**Total Price:** ${order['total_price']:.2f}")
-                st.write(f"**Supplier:** {order['supplier']}")
-                st.write(f"**Order Date:** {order['order_date']}")
-                st.write(f"**Delivery Date:** {order['delivery_date']}")
-                st.write(f"**Delivery Address:** {order['delivery_address']}")
-                st.write(f"**Project Name:** {order['project_name']}")
-                st.write(f"**Status:** {order['status']}")
-                st.write(f"**Last Updated:** {order['last_updated']}")
+            with st.expander(f"Order {order.order_id} - {order.material}"):
+                st.write(f"**Order ID:** {order.order_id}")
+                if order.purchase_order:
+                    st.write(f"**Purchase Order:** {order.purchase_order}")
+                st.write(f"**Material:** {order.material}")
+                st.write(f"**Quantity:** {order.quantity}")
+                st.write(f"**Total Price:** {format_money(order.total_cents)}")
+                st.write(f"**Supplier:** {order.supplier}")
+                st.write(f"**Order Date:** {format_date(order.ordered_at)}")
+                st.write(f"**Delivery Date:** {format_date(order.delivery_at)}")
+                st.write(f"**Delivery Address:** {order.delivery_address}")
+                st.write(f"**Project Name:** {order.project_name}")
+                st.write(f"**Status:** {order.status}")
+                st.write(f"**Last Updated:** {format_datetime(order.updated_at)}")
     else:
         st.write("No orders found")
 
+@METRICS.timed
 def show_supplier_interface():
     st.sidebar.button("← Back to Role Selection", on_click=reset_role)
     st.header("Supplier Dashboard")
@@ -488,116 +1031,241 @@ def show_supplier_interface():
     with tab3:
         create_supplier_orders_tab()
 
+@METRICS.timed
 def create_add_materials_tab():
     st.subheader("Add New Material")
     with st.form("add_material_form"):
         name = st.text_input("Material Name:*")
-        category = st.selectbox("Category:*", list(st.session_state.categories.keys()))
-        subcategories = st.session_state.categories.get(category, [])
+        categories = reference_data().categories
+        category = st.selectbox("Category:*", list(categories))
+        subcategories = categories.get(category, ())
         subcategory = st.selectbox("Subcategory:*", subcategories)
         price = st.text_input("Price (USD):*")
         min_order = st.text_input("Minimum Order Quantity:*")
         location = st.text_input("Location:*")
         contact = st.text_input("Contact Number:*")
-        availability = st.selectbox("Availability:*", [
-                "In Stock",
-                "Limited Stock",
-                "Out of Stock",
-                "Available on Order"
-            ])
+        availability = st.selectbox("Availability:*", list(Availability))
+        stock = st.number_input("Units in Stock", min_value=0, step=1, value=None,
+                                help="Leave empty to set availability by hand; when given, availability follows it")
         submitted = st.form_submit_button("Add Material")
         if submitted:
             if not all([name, category, subcategory, price, min_order, location, contact, availability]):
                 st.error("Please fill in all required fields")
             else:
                 try:
-                    new_material = {
+                    new_material = validate_material({
                         "name": name,
                         "category": category,
                         "subcategory": subcategory,
-                        "price": float(price),
-                        "minimum_order": int(min_order),
+                        "price": price,
+                        "minimum_order": min_order,
                         "location": location,
                         "contact": contact,
                         "availability": availability,
-                        "supplier": "Your Company",
-                        "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                    }
-                    st.session_state.materials.append(new_material)
+                        "stock": stock
+                    }, reference_data().categories)
+                    new_material.supplier = st.session_state.company
+                    new_material.updated_at = now_ts()
+                    get_store().add_material(new_material)
                     st.success("Material added successfully!")
-                except ValueError:
-                    st.error("Please enter valid numbers for price and minimum order")
+                except ValueError as error:
+                    st.error(str(error))
+    create_catalog_transfer_section()
+
+def create_catalog_transfer_section():
+    st.subheader("Bulk Import / Export")
+    catalog_file = st.file_uploader("Upload Catalog (CSV or JSON Lines)", type=["csv", "jsonl", "json", "ndjson"],
+                                    key="catalog_import")
+    if catalog_file is not None and st.button("Import Catalog"):
+        with METRICS.section("catalog_import"):
+            report = import_materials(get_store(), iter_rows(catalog_file, catalog_file.name),
+                                      reference_data().categories, st.session_state.company, now_ts())
+        st.success(f"Imported {report['inserted']} new and updated {report['updated']} existing materials")
+        if report['failed']:
+            st.error(f"{report['failed']} rows were rejected")
+            st.dataframe(report['errors'], hide_index=True)
+    file_format = st.radio("Export Format", ["csv", "jsonl"], format_func=lambda f: {"csv": "CSV", "jsonl": "JSON Lines"}[f],
+                           horizontal=True)
+    store = get_store()
+    company = st.session_state.company
+    col1, col2 = st.columns(2)
+    # Exports are only produced when clicked, streaming rows from the store
+    col1.download_button("Export Materials", file_name=f"materials.{file_format}",
+                         data=lambda: export_file(store.iter_records('materials', supplier=company),
+                                                  material_export_row, MATERIAL_EXPORT_FIELDS, file_format))
+    col2.download_button("Export Orders", file_name=f"orders.{file_format}",
+                         data=lambda: export_file(store.iter_records('orders', supplier=company),
+                                                  order_export_row, ORDER_EXPORT_FIELDS, file_format))
 
+@METRICS.timed
 def create_my_materials_tab():
     st.subheader("My Materials")
-    category_filter = st.selectbox("Category", ['All'] + list(st.session_state.categories.keys()))
-    availability_filter = st.selectbox("Availability", ['All', 'In Stock', 'Limited Stock', 'Out of Stock'])
-    materials = [material for material in st.session_state.materials if material['supplier'] == "Your Company"]
-    filtered_materials = [material for material in materials if
-                          (category_filter == 'All' or material['category'] == category_filter) and
-                          (availability_filter == 'All' or material['availability'] == availability_filter)]
+    category_filter = st.selectbox("Category", ('All',) + tuple(reference_data().categories))
+    availability_filter = st.selectbox("Availability", ['All'] + list(Availability))
+    store = get_store()
+    ids = store.list_ids('materials', supplier=st.session_state.company,
+                         **facet_filters(category=category_filter, availability=availability_filter))
+    filtered_materials = store.list_materials(
+        paginate(ids, "my_materials_page", (category_filter, availability_filter)))
     if filtered_materials:
         for material in filtered_materials:
-            with st.expander(material['name']):
-                st.write(f"**Category:** {material['category']} - {material['subcategory']}")
-                st.write(f"**Price:** ${material['price']:.2f}")
-                st.write(f"**Minimum Order:** {material['minimum_order']}")
-                st.write(f"**Availability:** {material['availability']}")
-                st.write(f"**Location:** {material['location']}")
-                st.write(f"**Contact Number:** {material['contact']}")
-                st.write(f"**Last Updated:** {material['last_updated']}")
-                st.write("### Edit Material")
-                with st.form(f"edit_material_form_{material['name']}"):
-                    price = st.text_input("Price (USD):*", value=str(material['price']))
-                    min_order = st.text_input("Minimum Order Quantity:*", value=str(material['minimum_order']))
-                    availability = st.selectbox("Availability:*", [
-                            "In Stock",
-                            "Limited Stock",
-                            "Out of Stock",
-                            "Available on Order"
-                        ], index=["In Stock", "Limited Stock", "Out of Stock", "Available on Order"].index(material['availability']))
-                    submitted = st.form_submit_button("Save Changes")
-                    if submitted:
-                        try:
-                            material['price'] = float(price)
-                            material['minimum_order'] = int(min_order)
-                            material['availability'] = availability
-                            material['last_updated'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                            st.success("Material updated successfully!")
-                        except ValueError:
-                            st.error("Please enter valid numbers for price and minimum order")
+            with st.expander(material.name):
+                st.write(f"**Category:** {material.category} - {material.subcategory}")
+                st.write(f"**Price:** {format_money(material.price_cents)}")
+                st.write(f"**Minimum Order:** {material.minimum_order}")
+                st.write(f"**Availability:** {format_availability(material)}")
+                st.write(f"**Location:** {material.location}")
+                st.write(f"**Contact Number:** {material.contact}")
+                st.write(f"**Last Updated:** {format_datetime(material.updated_at)}")
+                if st.toggle("Show History", key=f"material_history_{material.id}"):
+                    show_history("materials", material.id)
+                if st.toggle("Price History", key=f"price_history_{material.id}"):
+                    show_price_history(material)
+                if st.toggle("Edit Material", key=f"edit_open_{material.id}"):
+                    show_edit_material_form(material)
     else:
         st.write("No materials found")
 
+def show_edit_material_form(material):
+    st.write("### Edit Material")
+    with st.form(f"edit_material_form_{material.id}"):
+        price = st.text_input("Price (USD):*", value=f"{from_cents(material.price_cents):.2f}")
+        min_order = st.text_input("Minimum Order Quantity:*", value=str(material.minimum_order))
+        availability = st.selectbox("Availability:*", list(Availability),
+                                    index=list(Availability).index(material.availability))
+        if material.stock is None:
+            stock = st.number_input("Units in Stock", min_value=0, step=1, value=None,
+                                    help="Leave empty to set availability by hand; when given, availability follows it")
+        else:
+            # A change rather than a count, so orders placed while the form
+            # is open are not overwritten
+            st.write(f"**Units in Stock:** {material.stock:,}")
+            stock_change = st.number_input("Units Received (negative to write off)", step=1, value=0)
+        submitted = st.form_submit_button("Save Changes")
+        if submitted:
+            try:
+                price_cents = to_cents(float(price))
+                min_order = int(min_order)
+            except ValueError:
+                st.error("Please enter valid numbers for price and minimum order")
+                return
+            if min_order < 1:
+                st.error("Minimum order must be at least 1 unit")
+                return
+            store = get_store()
+            try:
+                with store.transaction():
+                    store.update_material(material.id, price_cents=price_cents, minimum_order=min_order,
+                                          availability=availability, updated_at=now_ts())
+                    if material.stock is not None and stock_change:
+                        store.adjust_stock(material.id, int(stock_change))
+                    elif material.stock is None and stock is not None:
+                        store.set_stock(material.id, int(stock), None)
+            except ValueError as error:
+                st.error(str(error))
+                return
+            st.success("Material updated successfully!")
+
+def show_supplier_kpis(supplier):
+    # Reads the order rollups only: a few rows per status and month
+    totals = get_store().order_totals(supplier)
+    this_month = datetime.date.today().strftime("%Y-%m")
+    sold = [row for row in totals if row['status'] != OrderStatus.CANCELLED]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Revenue", format_money(sum(row['total_cents'] for row in sold)))
+    col2.metric("This Month", format_money(sum(row['total_cents'] for row in sold if row['month'] == this_month)))
+    col3.metric("Orders", sum(row['orders'] for row in totals))
+    col4.metric("Open Orders", sum(row['orders'] for row in totals if row['status'] in
+                                   (OrderStatus.PENDING, OrderStatus.CONFIRMED, OrderStatus.IN_TRANSIT)))
+    with st.expander("Revenue Breakdown"):
+        by_status = {}
+        for row in totals:
+            orders, total = by_status.get(row['status'], (0, 0))
+            by_status[row['status']] = (orders + row['orders'], total + row['total_cents'])
+        st.dataframe([{"Status": status, "Orders": orders, "Total": format_money(total)}
+                      for status, (orders, total) in by_status.items()], hide_index=True)
+        st.dataframe([{"Month": row['month'], "Status": row['status'], "Orders": row['orders'],
+                       "Total": format_money(row['total_cents'])} for row in totals], hide_index=True)
+        st.dataframe([{"Material": row['material'], "Orders": row['orders'], "Quantity": row['quantity'],
+                       "Total": format_money(row['total_cents'])} for row in get_store().material_totals(supplier)],
+                     hide_index=True)
+
+@METRICS.timed
 def create_supplier_orders_tab():
     st.subheader("View Orders")
-    status_filter = st.selectbox("Status", ['All', 'Pending', 'Confirmed', 'In Transit', 'Delivered', 'Cancelled'])
-    orders = [order for order in st.session_state.orders if order['supplier'] == "Your Company"]
-    filtered_orders = [order for order in orders if status_filter == 'All' or order['status'] == status_filter]
+    show_supplier_kpis(st.session_state.company)
+    status_filter = st.selectbox("Status", ['All'] + list(OrderStatus))
+    show_supplier_orders(st.session_state.company, status_filter)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@METRICS.timed
+def show_supplier_orders(supplier, status_filter):
+    # Picks up new orders placed in other sessions
+    sync_changes()
+    topics = (f"supplier_orders:{supplier}",)
+    announce("supplier_orders_seen", topics, "Orders were placed or updated")
+    store = get_store()
+    ids = live_query("supplier_orders_ids", topics, (status_filter,), lambda: store.list_ids(
+        'orders', supplier=supplier, **facet_filters(status=status_filter)))
+    page_ids = tuple(paginate(ids, "supplier_orders_page", (status_filter,)))
+    filtered_orders = live_query("supplier_orders_rows", topics, page_ids, lambda: store.list_orders(page_ids))
     if filtered_orders:
         for order in filtered_orders:
-            with st.expander(f"Order {order['order_id']} - {order['material']}"):
-                st.write(f"**Order ID:** {order['order_id']}")
-                st.write(f"**Material:** {order['material']}")
-                st.write(f"**Quantity:** {order['quantity']}")
-                st.write(f"**Total Price:** ${order['total_price']:.2f}")
-                st.write(f"**Customer:** {order['contact_person']}")
-                st.write(f"**Phone:** {order['contact_phone']}")
-                st.write(f"**Order Date:** {order['order_date']}")
-                st.write(f"**Delivery Date:** {order['delivery_date']}")
-                st.write(f"**Delivery Address:** {order['delivery_address']}")
-                st.write(f"**Status:** {order['status']}")
-                st.write(f"**Last Updated:** {order['last_updated']}")
-                st.write("### Update Status")
-                with st.form(f"update_status_form_{order['order_id']}"):
-                    new_status = st.selectbox("Update Status", ['Pending', 'Confirmed', 'In Transit', 'Delivered', 'Cancelled'], index=['Pending', 'Confirmed', 'In Transit', 'Delivered', 'Cancelled'].index(order['status']))
-                    submitted = st.form_submit_button("Update Status")
-                    if submitted:
-                        order['status'] = new_status
-                        order['last_updated'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                        st.success("Order status updated successfully!")
+            with st.expander(f"Order {order.order_id} - {order.material}"):
+                st.write(f"**Order ID:** {order.order_id}")
+                if order.purchase_order:
+                    st.write(f"**Purchase Order:** {order.purchase_order}")
+                st.write(f"**Material:** {order.material}")
+                st.write(f"**Quantity:** {order.quantity}")
+                st.write(f"**Total Price:** {format_money(order.total_cents)}")
+                st.write(f"**Customer:** {order.contact_person}")
+                st.write(f"**Phone:** {order.contact_phone}")
+                st.write(f"**Order Date:** {format_date(order.ordered_at)}")
+                st.write(f"**Delivery Date:** {format_date(order.delivery_at)}")
+                st.write(f"**Delivery Address:** {order.delivery_address}")
+                st.write(f"**Status:** {order.status}")
+                st.write(f"**Last Updated:** {format_datetime(order.updated_at)}")
+                if st.toggle("Show History", key=f"order_history_{order.id}"):
+                    show_history("orders", order.id)
+                if st.toggle("Update Status", key=f"status_open_{order.id}"):
+                    show_update_status_form(order)
     else:
         st.write("No orders found")
 
+def format_change(column, value):
+    if column.endswith("_cents") and value is not None:
+        return format_money(value)
+    if column.endswith("_at") and value is not None:
+        return format_datetime(value)
+    return value
+
+def show_history(table, record_id):
+    # Old values only live in the event log; the store indexes it per record
+    st.dataframe([{
+        "When": format_datetime(int(event['at'])),
+        "Change": "Created" if event['op'] == "insert" else "Updated",
+        "Fields": ", ".join(f"{column}: {format_change(column, value)}" for column, value in event['fields'].items()
+                            if column != "updated_at")
+    } for event in get_store().history(table, record_id)], hide_index=True)
+
+def show_update_status_form(order):
+    st.write("### Update Status")
+    with st.form(f"update_status_form_{order.id}"):
+        new_status = st.selectbox("Update Status", list(OrderStatus), index=list(OrderStatus).index(order.status))
+        submitted = st.form_submit_button("Update Status")
+        if submitted:
+            try:
+                # Cancelling puts the units back in stock; reopening takes them again
+                get_store().update_order(
+                    order.id,
+                    status=new_status,
+                    updated_at=now_ts()
+                )
+            except ValueError as error:
+                st.error(str(error))
+                return
+            st.success("Order status updated successfully!")
+
 if __name__ == "__main__":
-    main()
+    with METRICS.rerun():
+        main()
@@ -0,0 +1,205 @@
+"""Headless rerun benchmarks for the marketplace dashboards.
+
+Seeds a synthetic marketplace at each scale, then drives the tab functions
+through Streamlit's AppTest with a set of filter combinations and reports
+rerun latency, peak traced memory and the number of rendered elements.
+
+    python benchmarks/dashboards.py --sizes 1000 10000 --runs 20
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import Construccionpa as app
+import reference_data
+from records import Availability, Bid, BidStatus, Material, Order, OrderStatus, Project, ProjectStatus, now_ts
+from storage import MarketplaceStore
+
+BENCH_USER = "user_bench"
+SUPPLIER = "Your Company"
+LOCATIONS = ["Panama City", "Costa del Este", "Obarrio", "San Francisco", "Punta Pacifica", "Clayton"]
+PROJECT_TYPES = ["High-rise Residential", "Commercial Office", "Commercial Retail", "Industrial", "Healthcare",
+                 "Infrastructure", "Renovation"]
+WORDS = ["tower", "plaza", "villas", "bodega", "clinic", "bridge", "residences", "offices", "mall", "warehouse",
+         "ocean", "garden", "steel", "modern", "luxury", "tubería", "cemento", "hierro", "bloque", "pintura"]
+
+SCRIPT = """
+import Construccionpa as app
+app.setup_session_state()
+app.{tab}()
+"""
+
+# (tab function, scenario name, {widget: value}); widgets are looked up by
+# key first and by label otherwise.
+SCENARIOS = [
+    ("create_available_projects_tab", "projects: unfiltered", {}),
+    ("create_available_projects_tab", "projects: search", {"project_search": "luxury tower"}),
+    ("create_available_projects_tab", "projects: location + type",
+     {"project_location": "Obarrio", "project_type": "Commercial Office"}),
+    ("create_available_projects_tab", "projects: budget range",
+     {"Min Budget (USD)": "1000000", "Max Budget (USD)": "5000000"}),
+    ("create_my_bids_tab", "my bids: all", {}),
+    ("create_my_bids_tab", "my bids: submitted", {"Status": "Submitted"}),
+    ("create_materials_search_tab", "materials: unfiltered", {}),
+    ("create_materials_search_tab", "materials: search", {"material_search": "cemento"}),
+    ("create_materials_search_tab", "materials: category + subcategory",
+     {"material_category": "Plumbing", "material_subcategory": "PVC Pipes"}),
+    ("create_materials_search_tab", "materials: price + availability",
+     {"Min Price (USD)": "10", "Max Price (USD)": "200", "material_availability": "In Stock"}),
+    ("create_orders_tab", "my orders: pending", {"Status": "Pending"}),
+    ("create_my_materials_tab", "supplier materials: category", {"Category": "Electrical"}),
+    ("create_supplier_orders_tab", "supplier orders: all", {}),
+    ("create_supplier_orders_tab", "supplier orders: in transit", {"Status": "In Transit"}),
+]
+
+
+def seed(store, size, categories, rng):
+    # Every table gets `size` rows; a few percent belong to the benchmark
+    # user or supplier so the owner dashboards have something to show.
+    def title():
+        return " ".join(rng.sample(WORDS, 3)).title()
+
+    with store.transaction():
+        for _ in range(size):
+            store.add_project(Project(
+                title=title(), location=rng.choice(LOCATIONS), type=rng.choice(PROJECT_TYPES),
+                budget_cents=rng.randrange(50_000, 20_000_000) * 100, description=" ".join(rng.choices(WORDS, k=12)),
+                status=ProjectStatus.OPEN, posted_at=now_ts() - rng.randrange(365 * 86400),
+                user_id=BENCH_USER if rng.random() < 0.02 else f"user_{rng.randrange(5000)}"))
+        for _ in range(size):
+            category = rng.choice(list(categories))
+            store.add_material(Material(
+                name=title(), category=category, subcategory=rng.choice(categories[category]),
+                supplier=SUPPLIER if rng.random() < 0.05 else f"Supplier {rng.randrange(200)}",
+                price_cents=rng.randrange(100, 100_000), availability=rng.choice(list(Availability)),
+                location=rng.choice(LOCATIONS), contact="6000-0000", minimum_order=rng.randrange(1, 50),
+                updated_at=now_ts()))
+        for _ in range(size):
+            submitted_at = now_ts() - rng.randrange(90 * 86400)
+            status = rng.choice(list(BidStatus))
+            store.add_bid(rng.randrange(1, size + 1), Bid(
+                amount_cents=rng.randrange(50_000, 20_000_000) * 100, timeline=rng.randrange(30, 720),
+                contractor=f"Contractor {rng.randrange(500)}", approach=" ".join(rng.choices(WORDS, k=20)),
+                experience=" ".join(rng.choices(WORDS, k=10)), submitted_at=submitted_at, status=status,
+                status_history=[{"status": status, "at": submitted_at, "notes": ""}],
+                user_id=BENCH_USER if rng.random() < 0.02 else f"user_{rng.randrange(5000)}"))
+        for _ in range(size):
+            quantity = rng.randrange(1, 500)
+            price_cents = rng.randrange(100, 100_000)
+            store.add_order(Order(
+                material=title(), supplier=SUPPLIER if rng.random() < 0.05 else f"Supplier {rng.randrange(200)}",
+                quantity=quantity, price_per_unit_cents=price_cents, total_cents=quantity * price_cents,
+                delivery_at=now_ts() + rng.randrange(30 * 86400), delivery_address="Calle 50",
+                project_name=title(), status=rng.choice(list(OrderStatus)), ordered_at=now_ts(),
+                updated_at=now_ts(), contact_person="Bench", contact_phone="6000-0000",
+                user_id=BENCH_USER if rng.random() < 0.02 else f"user_{rng.randrange(5000)}"))
+
+
+def count_elements(node):
+    children = getattr(node, "children", None) or {}
+    return 1 + sum(count_elements(child) for child in children.values())
+
+
+def find_widget(at, name):
+    for widgets in (at.text_input, at.selectbox):
+        for widget in widgets:
+            if widget.key == name or widget.label == name:
+                return widget
+    raise LookupError(f"No widget {name!r}")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def run_scenario(tab, settings, runs):
+    at = AppTest.from_string(SCRIPT.format(tab=tab), default_timeout=600)
+    at.session_state["user_id"] = BENCH_USER
+    at.session_state["company"] = SUPPLIER
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    # Widgets appear as earlier ones are set (a category reveals its
+    # subcategories), so each one is set and rerun in order.
+    for name, value in settings.items():
+        find_widget(at, name).set_value(value)
+        start = time.perf_counter()
+        at.run()
+        first = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"{tab} raised: {at.exception[0].value}")
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+    # Peak memory is taken on a separate rerun; tracing slows everything down
+    tracemalloc.start()
+    at.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "first_ms": first * 1000,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "peak_kib": peak / 1024,
+        "elements": count_elements(at.main),
+    }
+
+
+def benchmark(size, runs, data_dir):
+    rng = random.Random(size)
+    app.DATA_DIR = tempfile.mkdtemp(prefix=f"bench-{size}-", dir=data_dir)
+    st.cache_resource.clear()
+    categories = reference_data.load().categories
+    start = time.perf_counter()
+    seed(MarketplaceStore(os.path.join(app.DATA_DIR, "marketplace.db")), size, categories, rng)
+    print(f"\n{size:,} records per table (seeded in {time.perf_counter() - start:.1f}s)")
+    # The first rerun builds the per-process search and facet indexes
+    start = time.perf_counter()
+    AppTest.from_string(SCRIPT.format(tab="get_query_cache"), default_timeout=600).run()
+    print(f"index build {time.perf_counter() - start:.2f}s")
+    print(f"{'scenario':40} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'peak KiB':>9} {'elements':>8}")
+    results = []
+    for tab, name, settings in SCENARIOS:
+        result = run_scenario(tab, settings, runs)
+        print(f"{name:40} {result['first_ms']:9.1f} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['peak_kib']:9.0f} "
+              f"{result['elements']:8}")
+        results.append({"size": size, "scenario": name, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=20, help="timed reruns per scenario")
+    parser.add_argument("--data-dir", help="where to create the benchmark databases (default: system temp)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    # AppTest runs outside a server and warns about the missing script context
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: record.levelno >= logging.ERROR)
+    results = []
+    for size in args.sizes:
+        results.extend(benchmark(size, args.runs, args.data_dir))
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Concurrent checkouts against limited stock.
+
+Seeds a few materials with a fixed number of units each, then starts
+--processes processes of --threads threads, every thread placing cart
+checkouts of one to three lines as fast as it can. Now and then a thread
+cancels an order the way a supplier would, which puts its units back;
+the order is picked at random from those placed in its process, so the
+same order is sometimes cancelled twice at once.
+
+At the end it checks that no unit was sold twice or lost: for every
+material, the units still in stock plus the units held by orders that are
+not cancelled must equal what it started with, and the availability label
+must match the stock. It reports checkouts per second, checkouts refused
+for lack of stock, lock timeouts and latency percentiles.
+
+    python benchmarks/stock.py --processes 4 --threads 50 --seconds 20
+
+Exits with status 1 when a check fails.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from records import Availability, Material, Order, OrderStatus, now_ts, stock_availability
+from storage import MarketplaceStore
+
+SUPPLIERS = ["Argos", "Tuberias SA", "Ferreteria Central"]
+
+
+def checkout_orders(rng, material_ids):
+    ordered_at = now_ts()
+    orders = []
+    for index, material_id in enumerate(rng.sample(material_ids, rng.randint(1, min(3, len(material_ids))))):
+        quantity = rng.randint(1, 5)
+        orders.append(Order(
+            material=f"Stress material {material_id}", material_id=material_id, supplier=SUPPLIERS[index],
+            quantity=quantity, price_per_unit_cents=100, total_cents=quantity * 100, delivery_at=ordered_at,
+            delivery_address="Calle 50", project_name="Stress", status=OrderStatus.PENDING, ordered_at=ordered_at,
+            updated_at=ordered_at, contact_person="Bench", contact_phone="6000-0000", user_id="user_bench"))
+    return orders
+
+
+def shopper(store, material_ids, seconds, cancel_share, seed_value, go, placed, placed_lock, results):
+    rng = random.Random(seed_value)
+    latencies = []
+    checkouts = refused = cancels = timeouts = 0
+    go.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if placed and rng.random() < cancel_share:
+                with placed_lock:
+                    order_id = rng.choice(placed)
+                store.update_order(order_id, status=OrderStatus.CANCELLED, updated_at=now_ts())
+                cancels += 1
+            else:
+                orders = checkout_orders(rng, material_ids)
+                try:
+                    store.add_purchase_orders(orders)
+                except ValueError:
+                    refused += 1
+                else:
+                    checkouts += 1
+                    with placed_lock:
+                        placed.extend(order.id for order in orders)
+        except sqlite3.OperationalError:
+            # busy_timeout ran out waiting for the write lock
+            timeouts += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    results.append({"checkouts": checkouts, "refused": refused, "cancels": cancels, "timeouts": timeouts,
+                    "latencies": latencies})
+
+
+def worker(db_path, material_ids, threads, seconds, cancel_share, seed_value, ready, go, queue):
+    # One store (one SQLite connection) per process, shared by its threads
+    # like the Streamlit sessions of one server process share it
+    store = MarketplaceStore(db_path)
+    placed = []
+    placed_lock = threading.Lock()
+    results = []
+    shoppers = [threading.Thread(target=shopper, args=(store, material_ids, seconds, cancel_share,
+                                                       seed_value * 1000 + index, go, placed, placed_lock, results))
+                for index in range(threads)]
+    for thread in shoppers:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in shoppers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    queue.put({"seconds": elapsed, **{key: sum(result[key] for result in results)
+                                      for key in ("checkouts", "refused", "cancels", "timeouts")},
+               "latencies": [latency for result in results for latency in result["latencies"]]})
+
+
+def check(store, stock):
+    # Every unit is either still in stock or held by a live order
+    problems = []
+    held = {}
+    for order in store.list_orders():
+        if order.status != OrderStatus.CANCELLED:
+            held[order.material_id] = held.get(order.material_id, 0) + order.quantity
+    for material in store.list_materials():
+        units = material.stock + held.get(material.id, 0)
+        if units != stock:
+            problems.append(f"material {material.id}: {material.stock} in stock + {held.get(material.id, 0)} "
+                            f"ordered = {units}, expected {stock}")
+        if material.availability != stock_availability(material.stock, material.minimum_order):
+            problems.append(f"material {material.id}: {material.availability} with {material.stock} in stock")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=50, help="concurrent shoppers per process")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--materials", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=20000, help="units each material starts with")
+    parser.add_argument("--cancel-share", type=float, default=0.2, help="share of operations that cancel an order")
+    parser.add_argument("--data-dir", help="where to create the benchmark database (default: system temp)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench-stock-", dir=args.data_dir), "marketplace.db")
+    store = MarketplaceStore(db_path)
+    with store.transaction():
+        material_ids = [store.add_material(Material(
+            name=f"Stress material {index}", category="Concrete & Cement", subcategory="Cement Bags",
+            supplier=SUPPLIERS[index % len(SUPPLIERS)], price_cents=100, availability=Availability.IN_STOCK,
+            location="Panama City", contact="6000-0000", minimum_order=1, stock=args.stock, updated_at=now_ts()))
+            for index in range(args.materials)]
+
+    # Spawned rather than forked: a forked child would inherit SQLite state
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(args.processes + 1)
+    go = context.Event()
+    queue = context.Queue()
+    processes = [context.Process(target=worker, args=(db_path, material_ids, args.threads, args.seconds,
+                                                      args.cancel_share, index, ready, go, queue))
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Imports, connections and thread start-up are left out of the timing
+    ready.wait()
+    go.set()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    totals = {key: sum(result[key] for result in results) for key in ("checkouts", "refused", "cancels", "timeouts")}
+    seconds = max(result["seconds"] for result in results)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    problems = check(store, args.stock)
+    print(f"{args.processes} processes x {args.threads} threads, {os.cpu_count()} CPUs, {seconds:.1f}s")
+    print(f"checkouts {totals['checkouts']:,} ({totals['checkouts'] / seconds:,.0f}/s), "
+          f"refused for stock {totals['refused']:,}, cancellations {totals['cancels']:,}, "
+          f"lock timeouts {totals['timeouts']:,}")
+    print(f"latency p50 {percentiles[49] * 1000:.1f} ms, p95 {percentiles[94] * 1000:.1f} ms, "
+          f"p99 {percentiles[98] * 1000:.1f} ms")
+    for material in store.list_materials():
+        print(f"  {material.name}: {material.stock} left, {material.availability}")
+    print("stock consistent" if not problems else "\n".join(["STOCK INCONSISTENT", *problems]))
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump({"processes": args.processes, "threads": args.threads, "seconds": seconds, **totals,
+                       "p50_ms": percentiles[49] * 1000, "p99_ms": percentiles[98] * 1000,
+                       "consistent": not problems, "cpus": os.cpu_count()}, out, indent=2)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
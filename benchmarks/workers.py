@@ -0,0 +1,150 @@
+"""Rerun throughput of the multi-process deployment mode.
+
+Seeds one shared marketplace database, then for each worker count starts
+that many processes with PANAMA_MULTIPROCESS=1. Each process plays a few
+contractor sessions through Streamlit's AppTest: full reruns of the
+dashboard, with a new material written every --write-every reruns. It
+reports completed reruns per second in total and per worker.
+
+Every rerun names its session with ?sid=, picked at random from a pool
+shared by all workers, the way a load balancer without sticky sessions
+would route it. At the end each worker checks that its in-process facet
+index holds every material, including those written by the other
+workers.
+
+    python benchmarks/workers.py --workers 1 2 4 --seconds 20
+
+Throughput can only grow with worker count while there are idle cores.
+The script prints os.cpu_count() so results from different machines can
+be compared.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRIPT = """
+import Construccionpa as app
+app.main()
+"""
+
+
+def worker(data_dir, sids, seconds, write_every, sessions, seed_value, ready, start, results):
+    os.environ["PANAMA_DATA_DIR"] = data_dir
+    os.environ["PANAMA_MULTIPROCESS"] = "1"
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: record.levelno >= logging.ERROR)
+    from streamlit.testing.v1 import AppTest
+
+    import Construccionpa as app
+    from records import Availability, Material, now_ts
+
+    rng = random.Random(seed_value)
+    tests = []
+    for _ in range(sessions):
+        at = AppTest.from_string(SCRIPT, default_timeout=600)
+        at.query_params["sid"] = rng.choice(sids)
+        at.run()
+        tests.append(at)
+    ready.wait()
+    start.wait()
+    reruns = writes = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        at = rng.choice(tests)
+        # A different session on each rerun, as if routed here by chance; it
+        # is loaded from the database like on any worker seeing it first
+        at.query_params["sid"] = rng.choice(sids)
+        del at.session_state["sid"]
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        reruns += 1
+        if reruns % write_every == 0:
+            app.get_store().add_material(Material(
+                name=f"Bench material {seed_value}-{writes}", category="Plumbing", subcategory="PVC Pipes",
+                supplier="Bench Supplier", price_cents=rng.randrange(100, 10_000),
+                availability=Availability.IN_STOCK, location="Obarrio", contact="6000-0000", minimum_order=1,
+                updated_at=now_ts()))
+            writes += 1
+    elapsed = time.perf_counter() - started
+    # Let the last writes from the other workers land, then catch up on them
+    time.sleep(1)
+    app.get_store().sync()
+    results.put({"reruns": reruns, "writes": writes, "seconds": elapsed, "indexed": len(app.get_material_facets())})
+
+
+def run(workers, data_dir, sids, seconds, write_every, sessions):
+    # Spawned rather than forked: a forked child would inherit SQLite state
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers + 1)
+    start = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(data_dir, sids, seconds, write_every, sessions, index, ready,
+                                                       start, results))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    # Imports, index builds and first reruns are left out of the timing
+    ready.wait()
+    start.wait()
+    results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=20, help="timed run per worker count")
+    parser.add_argument("--size", type=int, default=10000, help="records per table")
+    parser.add_argument("--sessions", type=int, default=4, help="AppTest sessions per worker")
+    parser.add_argument("--session-pool", type=int, default=50, help="distinct sids shared by all workers")
+    parser.add_argument("--write-every", type=int, default=10, help="reruns between material writes")
+    parser.add_argument("--data-dir", help="where to create the benchmark database (default: system temp)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    import dashboards
+    import reference_data
+    from storage import MarketplaceStore
+
+    data_dir = tempfile.mkdtemp(prefix="bench-workers-", dir=args.data_dir)
+    store = MarketplaceStore(os.path.join(data_dir, "marketplace.db"), change_feed=True)
+    rng = random.Random(args.size)
+    dashboards.seed(store, args.size, reference_data.load().categories, rng)
+    # Contractor sessions as a first visit would have saved them
+    sids = [f"bench-{index}" for index in range(args.session_pool)]
+    for index, sid in enumerate(sids):
+        store.save_session(sid, {"role": "Contractor", "user_id": f"{dashboards.BENCH_USER}_{index}", "cart": []})
+    print(f"{args.size:,} records per table, {os.cpu_count()} CPUs, {args.seconds:g}s per run")
+    print(f"{'workers':>7} {'reruns':>7} {'reruns/s':>9} {'per worker':>10} {'scaling':>8} {'in sync':>8}")
+    rows = []
+    baseline = None
+    for workers in args.workers:
+        results = run(workers, data_dir, sids, args.seconds, args.write_every, args.sessions)
+        reruns = sum(result["reruns"] for result in results)
+        throughput = sum(result["reruns"] / result["seconds"] for result in results)
+        baseline = baseline or throughput / workers
+        materials = store.count("materials")
+        in_sync = all(result["indexed"] == materials for result in results)
+        print(f"{workers:7} {reruns:7} {throughput:9.1f} {throughput / workers:10.1f} "
+              f"{throughput / baseline:7.2f}x {'yes' if in_sync else 'NO':>8}")
+        rows.append({"workers": workers, "reruns": reruns, "reruns_per_s": throughput,
+                     "in_sync": in_sync, "cpus": os.cpu_count()})
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(rows, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Relative weight of each score component; they need not sum to one
+DEFAULT_WEIGHTS = (("price", 0.6), ("timeline", 0.4))
+OVER_BUDGET_RATIO = 1.2
+# Modified z-score beyond which a price counts as an outlier (Iglewicz and Hoaglin)
+OUTLIER_Z = 3.5
+# Scales the mean absolute deviation like 0.6745 scales the MAD, for when
+# more than half the bids share one amount and the MAD is zero
+MEAN_AD_SCALE = 1.253314
+
+
+def rank_bids(bids, budget_cents, weights=DEFAULT_WEIGHTS):
+    # Scores every bid of a project at once and returns one row per bid,
+    # best first. The cheapest and the fastest bid score 1 on their
+    # component and the others score relative to them.
+    if not bids:
+        return []
+    amounts = np.array([bid.amount_cents for bid in bids], dtype=float)
+    timelines = np.maximum(np.array([bid.timeline for bid in bids], dtype=float), 1)
+    components = {
+        "price": amounts.min() / np.maximum(amounts, 1),
+        "timeline": timelines.min() / timelines,
+    }
+    weights = dict(weights)
+    total = sum(weights.values()) or 1.0
+    scores = sum(components[name] * weight for name, weight in weights.items()) / total
+    budget_ratios = amounts / budget_cents if budget_cents else np.full(len(bids), np.nan)
+    # Percentage of bids promising this timeline or a shorter one
+    ordered = np.sort(timelines)
+    timeline_percentiles = np.searchsorted(ordered, timelines, side="right") / len(bids) * 100
+    # Median and MAD rather than mean and deviation, so one extreme bid
+    # cannot mask another
+    median = np.median(amounts)
+    mad = np.median(np.abs(amounts - median))
+    mean_ad = np.mean(np.abs(amounts - median))
+    if mad:
+        z_scores = 0.6745 * (amounts - median) / mad
+    elif mean_ad:
+        z_scores = (amounts - median) / (MEAN_AD_SCALE * mean_ad)
+    else:
+        # Every bid is for the same amount
+        z_scores = np.zeros(len(bids))
+    rows = []
+    for rank, index in enumerate(np.lexsort((np.arange(len(bids)), -scores)), start=1):
+        flags = []
+        if budget_ratios[index] > OVER_BUDGET_RATIO:
+            flags.append("over budget")
+        if z_scores[index] > OUTLIER_Z:
+            flags.append("unusually high")
+        elif z_scores[index] < -OUTLIER_Z:
+            flags.append("unusually low")
+        rows.append({
+            "rank": rank,
+            "bid": bids[index],
+            "budget_ratio": float(budget_ratios[index]),
+            "timeline_percentile": float(timeline_percentiles[index]),
+            "score": float(scores[index]),
+            "flags": flags,
+        })
+    return rows
+
+
+def timeline_quartiles(bids):
+    if not bids:
+        return None
+    return tuple(float(q) for q in np.percentile([bid.timeline for bid in bids], [25, 50, 75]))
@@ -0,0 +1,53 @@
+import hashlib
+import os
+import tempfile
+
+
+class BlobStore:
+    def __init__(self, root, chunk_size=1 << 20):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, stream):
+        # Hash while copying so a file is only read once, then move it into
+        # place under its digest; an existing copy wins and the upload is dropped.
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            digest = sha.hexdigest()
+            target = self.path(digest)
+            if os.path.exists(target):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return {'sha256': digest, 'size': size}
+
+    def read(self, digest):
+        # The whole blob as bytes, for small ones such as thumbnails
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def reader(self, digest):
+        # For st.download_button: the file is only opened on click and handed
+        # over as is, so Streamlit reads it once into its media store
+        return lambda: open(self.path(digest), "rb")
@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import os
+import tempfile
+
+from records import Availability, Material, format_date, format_datetime, from_cents, to_cents
+
+MATERIAL_FIELDS = ["name", "category", "subcategory", "price", "minimum_order", "location", "contact", "availability"]
+# Optional; when given, availability follows from it
+MATERIAL_OPTIONAL_FIELDS = ["stock"]
+MATERIAL_EXPORT_FIELDS = MATERIAL_FIELDS + MATERIAL_OPTIONAL_FIELDS + ["supplier", "last_updated"]
+ORDER_EXPORT_FIELDS = [
+    "order_id", "material", "supplier", "quantity", "price_per_unit", "total_price", "delivery_date",
+    "delivery_address", "project_name", "instructions", "status", "order_date", "last_updated",
+    "contact_person", "contact_phone", "purchase_order"
+]
+MAX_REPORTED_ERRORS = 1000
+
+
+def validate_material(row, categories):
+    # The same rules as the Add Material form; raises ValueError with a
+    # message fit to show the supplier.
+    missing = [field for field in MATERIAL_FIELDS if not str(row.get(field) or "").strip()]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    try:
+        price_cents = to_cents(float(row['price']))
+        minimum_order = int(row['minimum_order'])
+    except (TypeError, ValueError):
+        raise ValueError("Please enter valid numbers for price and minimum order")
+    if minimum_order < 1:
+        raise ValueError("Minimum order must be at least 1 unit")
+    category = str(row['category']).strip()
+    subcategory = str(row['subcategory']).strip()
+    if category not in categories:
+        raise ValueError(f"Unknown category: {category}")
+    if subcategory not in categories[category]:
+        raise ValueError(f"Unknown subcategory for {category}: {subcategory}")
+    availability = str(row['availability']).strip()
+    if availability not in set(Availability):
+        raise ValueError(f"Unknown availability: {availability}")
+    stock = str(row.get('stock') if row.get('stock') is not None else "").strip()
+    if stock and not stock.isdigit():
+        raise ValueError("Stock must be a whole number of units")
+    return Material(
+        name=str(row['name']).strip(),
+        category=category,
+        subcategory=subcategory,
+        price_cents=price_cents,
+        minimum_order=minimum_order,
+        location=str(row['location']).strip(),
+        contact=str(row['contact']).strip(),
+        availability=availability,
+        stock=int(stock) if stock else None
+    )
+
+
+def iter_csv_rows(stream):
+    # Yields (row_number, row, error) one line at a time
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    try:
+        for row in reader:
+            yield reader.line_num, row, None
+    except (csv.Error, UnicodeDecodeError) as error:
+        yield reader.line_num, None, f"Unreadable CSV: {error}"
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+
+
+def iter_jsonl_rows(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig")
+    number = 0
+    try:
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield number, None, f"Invalid JSON: {error.msg}"
+                continue
+            if isinstance(row, dict):
+                yield number, row, None
+            else:
+                yield number, None, "Each line must be a JSON object"
+    except UnicodeDecodeError as error:
+        yield number + 1, None, f"Unreadable file: {error}"
+    finally:
+        text.detach()
+
+
+def iter_rows(stream, file_name):
+    stream.seek(0)
+    if file_name.lower().endswith((".jsonl", ".json", ".ndjson")):
+        return iter_jsonl_rows(stream)
+    return iter_csv_rows(stream)
+
+
+def import_materials(store, rows, categories, supplier, updated_at, batch_size=500):
+    # Rows are validated and upserted batch by batch, so memory stays bounded
+    # by batch_size whatever the file size. Each batch is one transaction.
+    report = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    batch = []
+
+    def fail(number, error):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "error": error})
+
+    def flush():
+        inserted, updated, rejected = store.upsert_materials([material for _, material in batch])
+        report["inserted"] += inserted
+        report["updated"] += updated
+        for position, error in rejected:
+            fail(batch[position][0], error)
+        batch.clear()
+
+    for number, row, error in rows:
+        if error is None:
+            try:
+                material = validate_material(row, categories)
+            except ValueError as invalid:
+                error = str(invalid)
+        if error is not None:
+            fail(number, error)
+            continue
+        material.supplier = supplier
+        material.updated_at = updated_at
+        batch.append((number, material))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def material_export_row(material):
+    # Exports use the same units as the import, so a file round-trips
+    return {
+        "name": material.name,
+        "category": material.category,
+        "subcategory": material.subcategory,
+        "price": from_cents(material.price_cents),
+        "minimum_order": material.minimum_order,
+        "location": material.location,
+        "contact": material.contact,
+        "availability": material.availability.value,
+        "stock": material.stock,
+        "supplier": material.supplier,
+        "last_updated": format_datetime(material.updated_at)
+    }
+
+
+def order_export_row(order):
+    return {
+        "order_id": order.order_id,
+        "material": order.material,
+        "supplier": order.supplier,
+        "quantity": order.quantity,
+        "price_per_unit": from_cents(order.price_per_unit_cents),
+        "total_price": from_cents(order.total_cents),
+        "delivery_date": format_date(order.delivery_at),
+        "delivery_address": order.delivery_address,
+        "project_name": order.project_name,
+        "instructions": order.instructions,
+        "status": order.status.value,
+        "order_date": format_date(order.ordered_at),
+        "last_updated": format_datetime(order.updated_at),
+        "contact_person": order.contact_person,
+        "contact_phone": order.contact_phone,
+        "purchase_order": order.purchase_order
+    }
+
+
+def write_csv(records, stream, fields):
+    writer = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+
+
+def write_jsonl(records, stream, fields):
+    for record in records:
+        stream.write(json.dumps({field: record.get(field) for field in fields}, ensure_ascii=False))
+        stream.write("\n")
+
+
+def export_file(records, to_row, fields, file_format):
+    # Rows are streamed to a temporary file rather than built up in memory;
+    # the returned handle stays readable after the path is unlinked.
+    write = write_jsonl if file_format == "jsonl" else write_csv
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=f".{file_format}",
+                                     delete=False) as out:
+        write(map(to_row, records), out, fields)
+    exported = open(out.name, "rb")
+    os.unlink(out.name)
+    return exported
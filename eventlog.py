@@ -0,0 +1,156 @@
+import glob
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+class EventLog:
+    # Append-only JSON Lines record of every committed insert and update.
+    # The store assigns each event a sequence number inside the transaction
+    # that makes the change, so numbers follow commit order across
+    # processes. Lines are written and fsynced by a background thread in
+    # batches; writers only enqueue.
+    def __init__(self, root, db_path, flush_interval=0.05, segment_events=100_000, snapshot_every=50_000,
+                 keep_snapshots=2):
+        self.root = root
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.segment_events = segment_events
+        self.snapshot_every = snapshot_every
+        self.keep_snapshots = keep_snapshots
+        self.snapshot_dir = os.path.join(root, "snapshots")
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="eventlog", daemon=True)
+        self._writer.start()
+
+    def segment_path(self, seq):
+        return os.path.join(self.root, f"events-{seq // self.segment_events:08d}.jsonl")
+
+    def append(self, events):
+        self._queue.put(events)
+
+    def flush(self):
+        # Blocks until everything appended so far is on disk
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batches = [self._queue.get()]
+            # Whatever arrives within the flush interval shares one fsync
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while (remaining := deadline - time.monotonic()) > 0:
+                    batches.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                pass
+            try:
+                self._write([event for batch in batches for event in batch])
+            except Exception:
+                LOGGER.exception("Could not write %d events", sum(len(batch) for batch in batches))
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    def _write(self, events):
+        segments = {}
+        for event in events:
+            segments.setdefault(self.segment_path(event['seq']), []).append(
+                json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+        for path, lines in segments.items():
+            # O_APPEND keeps whole lines intact when several processes write
+            with open(path, "a", encoding="utf-8") as out:
+                out.write("".join(lines))
+                out.flush()
+                os.fsync(out.fileno())
+        if any(event['seq'] % self.snapshot_every == 0 for event in events):
+            self.snapshot()
+
+    def snapshots(self):
+        return sorted(glob.glob(os.path.join(self.snapshot_dir, "snapshot-*.db")))
+
+    def snapshot(self):
+        # A consistent copy of the live database through SQLite's backup API.
+        # The copy's own 'events' sequence says which events it already holds.
+        temp_path = os.path.join(self.snapshot_dir, f"snapshot.{os.getpid()}.tmp")
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(temp_path)
+        try:
+            source.backup(target)
+            row = target.execute("SELECT value FROM sequences WHERE name = 'events'").fetchone()
+        finally:
+            target.close()
+            source.close()
+        seq = row[0] if row else 0
+        path = os.path.join(self.snapshot_dir, f"snapshot-{seq:012d}.db")
+        os.replace(temp_path, path)
+        for old in self.snapshots()[:-self.keep_snapshots]:
+            os.unlink(old)
+        return path
+
+    def events(self, after=0):
+        # Events with seq > after, in order. Concurrent writers may interleave
+        # lines within a segment, so each segment is sorted before replay.
+        first_segment = self.segment_path(after + 1)
+        for path in sorted(glob.glob(os.path.join(self.root, "events-*.jsonl"))):
+            if path < first_segment:
+                continue
+            with open(path, encoding="utf-8") as lines:
+                events = []
+                for line in lines:
+                    # A crash mid-write can leave a partial last line
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        LOGGER.warning("Skipping unreadable event line in %s", path)
+            events.sort(key=lambda event: event['seq'])
+            yield from (event for event in events if event['seq'] > after)
+
+    def read(self, seqs):
+        # The events with these sequence numbers, in order. Only the segments
+        # holding them are opened, and only their lines are parsed.
+        by_segment = {}
+        for seq in seqs:
+            by_segment.setdefault(self.segment_path(seq), set()).add(seq)
+        events = []
+        for path, wanted in sorted(by_segment.items()):
+            try:
+                lines = open(path, encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with lines:
+                for line in lines:
+                    # _write puts seq first: {"seq":123,...
+                    seq = line[7:line.find(",", 7)]
+                    if not (line.startswith('{"seq":') and seq.isdigit() and int(seq) in wanted):
+                        continue
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        LOGGER.warning("Skipping unreadable event line in %s", path)
+        events.sort(key=lambda event: event['seq'])
+        return events
+
+
+def recover(root, db_path):
+    # Rebuilds a lost database from the newest snapshot plus the events
+    # logged after it
+    from storage import MarketplaceStore
+
+    log = EventLog(root, db_path)
+    snapshots = log.snapshots()
+    if snapshots:
+        shutil.copyfile(snapshots[-1], db_path)
+    store = MarketplaceStore(db_path)
+    row = store._query("SELECT value FROM sequences WHERE name = 'events'")
+    replayed = store.replay(log.events(after=row[0]['value'] if row else 0))
+    LOGGER.info("Recovered %s from %s and %d logged events", db_path, snapshots[-1] if snapshots else "scratch",
+                replayed)
+    return store
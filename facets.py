@@ -0,0 +1,81 @@
+import bisect
+import threading
+
+PROJECT_FACETS = ("location", "type", "status")
+PROJECT_RANGES = ("budget_cents",)
+MATERIAL_FACETS = ("category", "subcategory", "location", "availability")
+MATERIAL_RANGES = ("price_cents",)
+
+
+class FacetIndex:
+    def __init__(self, categorical, numeric=()):
+        self.categorical = categorical
+        self.numeric = numeric
+        self._lock = threading.Lock()
+        self._postings = {field: {} for field in categorical}
+        self._sorted = {field: [] for field in numeric}
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc_id, record):
+        with self._lock:
+            self._remove(doc_id)
+            values = {field: record.get(field) for field in self.categorical + self.numeric}
+            self._documents[doc_id] = values
+            for field in self.categorical:
+                self._postings[field].setdefault(values[field], set()).add(doc_id)
+            for field in self.numeric:
+                if values[field] is not None:
+                    bisect.insort(self._sorted[field], (values[field], doc_id))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        values = self._documents.pop(doc_id, None)
+        if values is None:
+            return
+        for field in self.categorical:
+            postings = self._postings[field][values[field]]
+            postings.discard(doc_id)
+            if not postings:
+                del self._postings[field][values[field]]
+        for field in self.numeric:
+            if values[field] is not None:
+                entries = self._sorted[field]
+                del entries[bisect.bisect_left(entries, (values[field], doc_id))]
+
+    def _range(self, field, low, high):
+        entries = self._sorted[field]
+        start = 0 if low is None else bisect.bisect_left(entries, (low, float('-inf')))
+        end = len(entries) if high is None else bisect.bisect_right(entries, (high, float('inf')))
+        return {doc_id for _, doc_id in entries[start:end]}
+
+    def select(self, filters=None, ranges=None, ids=None):
+        # filters maps a categorical field to one value, ranges maps a numeric
+        # field to (low, high) with None for an open end, and ids optionally
+        # restricts the result to an existing candidate set. Returns the ids
+        # sorted, or None when nothing constrains the selection.
+        with self._lock:
+            sets = [] if ids is None else [set(ids)]
+            for field, value in (filters or {}).items():
+                sets.append(self._postings[field].get(value, set()))
+            for field, (low, high) in (ranges or {}).items():
+                if low is not None or high is not None:
+                    sets.append(self._range(field, low, high))
+            if not sets:
+                return None
+            sets.sort(key=len)
+            result = set(sets[0])
+            for other in sets[1:]:
+                result &= other
+                if not result:
+                    break
+        return sorted(result)
+
+    def counts(self, field):
+        with self._lock:
+            return {value: len(postings) for value, postings in self._postings[field].items()}
@@ -0,0 +1,187 @@
+import math
+import re
+import threading
+import unicodedata
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Offline gazetteer: (place, district, province, latitude, longitude).
+# Coordinates are approximate centroids, good to a kilometre or two, which
+# is all a delivery-distance estimate needs.
+PLACES = (
+    ("Panama City", "Panamá", "Panamá", 8.9824, -79.5199),
+    ("San Felipe", "Panamá", "Panamá", 8.9520, -79.5350),
+    ("Santa Ana", "Panamá", "Panamá", 8.9590, -79.5360),
+    ("Calidonia", "Panamá", "Panamá", 8.9680, -79.5330),
+    ("Curundú", "Panamá", "Panamá", 8.9770, -79.5440),
+    ("Bella Vista", "Panamá", "Panamá", 8.9830, -79.5230),
+    ("El Cangrejo", "Panamá", "Panamá", 8.9930, -79.5270),
+    ("Obarrio", "Panamá", "Panamá", 8.9900, -79.5180),
+    ("Marbella", "Panamá", "Panamá", 8.9830, -79.5140),
+    ("Punta Paitilla", "Panamá", "Panamá", 8.9790, -79.5170),
+    ("Punta Pacifica", "Panamá", "Panamá", 8.9800, -79.5080),
+    ("San Francisco", "Panamá", "Panamá", 8.9950, -79.5050),
+    ("Bethania", "Panamá", "Panamá", 9.0080, -79.5290),
+    ("Pueblo Nuevo", "Panamá", "Panamá", 9.0120, -79.5090),
+    ("Parque Lefevre", "Panamá", "Panamá", 9.0130, -79.4880),
+    ("Río Abajo", "Panamá", "Panamá", 9.0250, -79.4900),
+    ("Costa del Este", "Panamá", "Panamá", 9.0110, -79.4660),
+    ("Juan Díaz", "Panamá", "Panamá", 9.0350, -79.4550),
+    ("Pedregal", "Panamá", "Panamá", 9.0700, -79.4300),
+    ("Ancón", "Panamá", "Panamá", 8.9700, -79.5600),
+    ("Albrook", "Panamá", "Panamá", 8.9730, -79.5500),
+    ("Balboa", "Panamá", "Panamá", 8.9550, -79.5660),
+    ("Clayton", "Panamá", "Panamá", 9.0000, -79.5700),
+    ("Amador", "Panamá", "Panamá", 8.9190, -79.5340),
+    ("Las Cumbres", "Panamá", "Panamá", 9.0950, -79.5300),
+    ("Chilibre", "Panamá", "Panamá", 9.1530, -79.6200),
+    ("Tocumen", "Panamá", "Panamá", 9.0800, -79.3830),
+    ("24 de Diciembre", "Panamá", "Panamá", 9.1000, -79.3600),
+    ("Las Mañanitas", "Panamá", "Panamá", 9.0970, -79.4000),
+    ("Pacora", "Panamá", "Panamá", 9.0830, -79.2830),
+    ("San Miguelito", "San Miguelito", "Panamá", 9.0500, -79.4700),
+    ("Brisas del Golf", "San Miguelito", "Panamá", 9.0600, -79.4500),
+    ("Arraiján", "Arraiján", "Panamá Oeste", 8.9500, -79.6500),
+    ("Vista Alegre", "Arraiján", "Panamá Oeste", 8.9330, -79.7000),
+    ("Veracruz", "Arraiján", "Panamá Oeste", 8.8900, -79.6200),
+    ("Panamá Pacífico", "Arraiján", "Panamá Oeste", 8.9150, -79.6000),
+    ("La Chorrera", "La Chorrera", "Panamá Oeste", 8.8800, -79.7830),
+    ("Capira", "Capira", "Panamá Oeste", 8.7570, -79.8800),
+    ("Chame", "Chame", "Panamá Oeste", 8.5800, -79.8800),
+    ("Coronado", "Chame", "Panamá Oeste", 8.5300, -79.8900),
+    ("San Carlos", "San Carlos", "Panamá Oeste", 8.4800, -79.9600),
+    ("Colón", "Colón", "Colón", 9.3590, -79.9010),
+    ("Sabanitas", "Colón", "Colón", 9.3400, -79.8000),
+    ("Portobelo", "Portobelo", "Colón", 9.5500, -79.6500),
+    ("Penonomé", "Penonomé", "Coclé", 8.5180, -80.3570),
+    ("Antón", "Antón", "Coclé", 8.4000, -80.2600),
+    ("Aguadulce", "Aguadulce", "Coclé", 8.2440, -80.5440),
+    ("Natá", "Natá", "Coclé", 8.3330, -80.5170),
+    ("Chitré", "Chitré", "Herrera", 7.9610, -80.4290),
+    ("Las Tablas", "Las Tablas", "Los Santos", 7.7640, -80.2740),
+    ("Pedasí", "Pedasí", "Los Santos", 7.5300, -80.0300),
+    ("Santiago", "Santiago", "Veraguas", 8.1000, -80.9830),
+    ("Soná", "Soná", "Veraguas", 8.0100, -81.3200),
+    ("David", "David", "Chiriquí", 8.4270, -82.4310),
+    ("Boquete", "Boquete", "Chiriquí", 8.7800, -82.4400),
+    ("La Concepción", "Bugaba", "Chiriquí", 8.5130, -82.6190),
+    ("Volcán", "Tierras Altas", "Chiriquí", 8.7700, -82.6400),
+    ("Puerto Armuelles", "Barú", "Chiriquí", 8.2800, -82.8600),
+    ("Bocas del Toro", "Bocas del Toro", "Bocas del Toro", 9.3400, -82.2400),
+    ("Changuinola", "Changuinola", "Bocas del Toro", 9.4300, -82.5200),
+    ("Metetí", "Pinogana", "Darién", 8.4900, -77.9800),
+    ("La Palma", "Chepigana", "Darién", 8.4100, -78.1500),
+)
+# Other names people write for the same places
+ALIASES = {
+    "Panama": "Panama City",
+    "Ciudad de Panamá": "Panama City",
+    "Casco Viejo": "San Felipe",
+    "Casco Antiguo": "San Felipe",
+    "Paitilla": "Punta Paitilla",
+    "Howard": "Panamá Pacífico",
+    "Chorrera": "La Chorrera",
+}
+
+
+class Place:
+    __slots__ = ("name", "district", "province", "latitude", "longitude")
+
+    def __init__(self, name, district, province, latitude, longitude):
+        self.name = name
+        self.district = district
+        self.province = province
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def __repr__(self):
+        return f"Place({self.name!r})"
+
+
+def normalize(text):
+    # Lowercase, accents stripped, punctuation as spaces
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+PLACES_BY_NAME = {normalize(place[0]): Place(*place) for place in PLACES}
+PLACES_BY_NAME.update({normalize(alias): PLACES_BY_NAME[normalize(name)] for alias, name in ALIASES.items()})
+# Longest names first, so "Panama City" is not read as "Panama"
+NAME_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(name) for name in sorted(PLACES_BY_NAME, key=len, reverse=True)) + r")\b")
+
+
+def geocode(text):
+    # The gazetteer place named in a free-text location or address, or None.
+    # The longest name mentioned wins: "Panama, Costa del Este" is Costa
+    # del Este.
+    names = NAME_PATTERN.findall(normalize(text))
+    return PLACES_BY_NAME[max(names, key=len)] if names else None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    # Buckets records by a fixed grid of latitude/longitude cells, so a
+    # radius query looks only at the cells its bounding box covers. Within
+    # a cell, records at the same point share one distance computation;
+    # geocoded depots cluster on a few dozen centroids.
+    def __init__(self, cell_degrees=0.05):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def add(self, doc_id, record):
+        with self._lock:
+            self._remove(doc_id)
+            latitude, longitude = record.get('latitude'), record.get('longitude')
+            if latitude is None or longitude is None:
+                return
+            point = (latitude, longitude)
+            self._points[doc_id] = point
+            self._cells.setdefault(self._cell(*point), {}).setdefault(point, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        point = self._points.pop(doc_id, None)
+        if point is None:
+            return
+        cell_key = self._cell(*point)
+        cell = self._cells[cell_key]
+        cell[point].discard(doc_id)
+        if not cell[point]:
+            del cell[point]
+            if not cell:
+                del self._cells[cell_key]
+
+    def within(self, latitude, longitude, radius_km):
+        # (distance_km, doc_id) pairs within the radius, nearest first
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+        row_min, col_min = self._cell(latitude - lat_span, longitude - lon_span)
+        row_max, col_max = self._cell(latitude + lat_span, longitude + lon_span)
+        matches = []
+        with self._lock:
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    for point, doc_ids in self._cells.get((row, col), {}).items():
+                        distance = haversine_km(latitude, longitude, *point)
+                        if distance <= radius_km:
+                            matches.extend((distance, doc_id) for doc_id in doc_ids)
+        matches.sort()
+        return matches
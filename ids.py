@@ -0,0 +1,27 @@
+import os
+import threading
+import time
+
+# Crockford base32, as used by ULIDs
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_lock = threading.Lock()
+_last = (0, 0)
+
+
+def ulid():
+    # 48-bit millisecond timestamp followed by 80 random bits: sorts by
+    # creation time and is unique across processes without coordination.
+    # Within one millisecond the random part is incremented so ids from this
+    # process stay strictly increasing.
+    global _last
+    with _lock:
+        millis = time.time_ns() // 1_000_000
+        last_millis, last_random = _last
+        if millis <= last_millis:
+            millis, random = last_millis, last_random + 1
+        else:
+            random = int.from_bytes(os.urandom(10), "big")
+        _last = (millis, random)
+    value = (millis << 80) | (random & ((1 << 80) - 1))
+    return "".join(ALPHABET[(value >> shift) & 31] for shift in range(125, -1, -5))
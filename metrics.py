@@ -0,0 +1,133 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds in seconds, as in a Prometheus histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    def __init__(self, enabled=False, export_path=None, capacity=5000, buckets=BUCKETS):
+        # Disabled metrics cost one attribute check per timed call
+        self.enabled = enabled
+        self.export_path = export_path
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=capacity)
+        self._histograms = {}
+        self._reruns = itertools.count(1)
+        self._local = threading.local()
+
+    @contextmanager
+    def rerun(self):
+        # Tags every section timed on this thread with one rerun number;
+        # each session's script runs on its own thread.
+        if not self.enabled:
+            yield
+            return
+        self._local.rerun = next(self._reruns)
+        try:
+            yield
+        finally:
+            self._local.rerun = None
+            if self.export_path:
+                self.export(self.export_path)
+
+    @contextmanager
+    def section(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self.section(func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._recent.append((getattr(self._local, "rerun", None), name, seconds))
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0,
+                                                      "count": 0}
+            histogram["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def slowest(self, reruns=20, limit=15):
+        # The slowest sections among the last `reruns` reruns
+        with self._lock:
+            recent = list(self._recent)
+        numbers = sorted({rerun for rerun, _, _ in recent if rerun is not None})[-reruns:]
+        wanted = set(numbers)
+        rows = [{"rerun": rerun, "section": name, "ms": round(seconds * 1000, 2)}
+                for rerun, name, seconds in recent if rerun in wanted]
+        rows.sort(key=lambda row: row["ms"], reverse=True)
+        return rows[:limit]
+
+    def summary(self):
+        # Per-section percentiles over the ring buffer, slowest p95 first
+        with self._lock:
+            recent = list(self._recent)
+        timings = {}
+        for _, name, seconds in recent:
+            timings.setdefault(name, []).append(seconds)
+        rows = []
+        for name, values in timings.items():
+            values.sort()
+            rows.append({
+                "section": name,
+                "count": len(values),
+                "p50 ms": round(values[len(values) // 2] * 1000, 2),
+                "p95 ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2),
+                "max ms": round(values[-1] * 1000, 2),
+            })
+        rows.sort(key=lambda row: row["p95 ms"], reverse=True)
+        return rows
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP panama_section_seconds Time spent in instrumented sections of a rerun.",
+            "# TYPE panama_section_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {name: dict(histogram, buckets=list(histogram["buckets"]))
+                          for name, histogram in sorted(self._histograms.items())}
+        for name, histogram in histograms.items():
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                lines.append(f'panama_section_seconds_bucket{{section="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'panama_section_seconds_sum{{section="{label}"}} {histogram["sum"]}')
+            lines.append(f'panama_section_seconds_count{{section="{label}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        # Written whole and renamed into place, so a scraper never reads half a file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as out:
+            out.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+# Opt in with PANAMA_METRICS=1; PANAMA_METRICS_FILE also writes the
+# Prometheus text export after every rerun (e.g. for node_exporter's
+# textfile collector).
+METRICS = Metrics(enabled=os.environ.get("PANAMA_METRICS", "") not in ("", "0"),
+                  export_path=os.environ.get("PANAMA_METRICS_FILE"))
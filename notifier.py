@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+
+# Topics are plain strings such as "bids", "bids:<developer user_id>",
+# "orders:<user_id>" or "supplier_orders:<supplier>". A broker only keeps a
+# version counter per topic: sessions remember the versions they last
+# rendered and reload when one moves, so a quiet topic costs a lookup and
+# nothing else.
+
+
+class LocalBroker:
+    # For a single server process, where every session shares this object
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def publish(self, topic):
+        with self._lock:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+
+    def versions(self, topics):
+        with self._lock:
+            return tuple(self._versions.get(topic, 0) for topic in topics)
+
+
+class SQLiteBroker:
+    # Shares topic versions between server processes through a small SQLite
+    # file next to the database, kept apart so publishing never waits on
+    # marketplace writes
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS topics (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def publish(self, topic):
+        with self._lock:
+            self._conn.execute("INSERT INTO topics (topic, version) VALUES (?, 1) "
+                               "ON CONFLICT (topic) DO UPDATE SET version = version + 1", (topic,))
+
+    def versions(self, topics):
+        with self._lock:
+            rows = dict(self._conn.execute(
+                f"SELECT topic, version FROM topics WHERE topic IN ({', '.join('?' for _ in topics)})", topics))
+        return tuple(rows.get(topic, 0) for topic in topics)
+
+
+def change_topics(table, record, owner=None):
+    # Which topics a committed change wakes up; owner is the developer whose
+    # project a bid was placed on
+    if table == "projects":
+        return ["projects", f"projects:{record.user_id}"] if record is not None else ["projects"]
+    if table == "bids":
+        return ["bids", f"bids:{owner}"] if owner else ["bids"]
+    if table == "orders" and record is not None:
+        return [f"orders:{record.user_id}", f"supplier_orders:{record.supplier}"]
+    return []
+
+
+def publish_changes(store, broker):
+    # Publishes every write this process commits; with a shared broker the
+    # other processes see it on their next poll
+    def publish(table, record_id):
+        record = store.get_record(table, record_id) if table in ("projects", "bids", "orders") else None
+        owner = None
+        if table == "bids" and record is not None:
+            project = store.get_record("projects", record.project_id)
+            owner = project and project.user_id
+        for topic in change_topics(table, record, owner):
+            broker.publish(topic)
+
+    store.subscribe(publish)
+    return broker
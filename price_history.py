@@ -0,0 +1,95 @@
+import bisect
+import time
+from array import array
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+PERIODS = {"day": DAY, "week": WEEK}
+# 1970-01-01 was a Thursday; weekly buckets start on Mondays
+WEEK_OFFSET = 4 * DAY
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def bucket_start(ts, period):
+    # Buckets begin at local midnight, like the monthly order rollups. The
+    # midnight is converted back with the UTC offset in force at that
+    # midnight, which differs from ts's when the clocks changed in between.
+    size = PERIODS[period]
+    offset = WEEK_OFFSET if period == "week" else 0
+    local = (ts + time.localtime(ts).tm_gmtoff - offset) // size * size + offset
+    return local - time.localtime(local - time.localtime(ts).tm_gmtoff).tm_gmtoff
+
+
+class PriceSeries:
+    # Every price a material has had, as two parallel arrays of 64-bit ints
+    # (epoch seconds and cents) sorted by time. Stored as two BLOBs, so a
+    # year of daily changes is under 6 KB and loads without parsing.
+    __slots__ = ("timestamps", "prices")
+
+    def __init__(self, timestamps=(), prices=()):
+        self.timestamps = array("q", timestamps)
+        self.prices = array("q", prices)
+
+    @classmethod
+    def from_blobs(cls, timestamps, prices):
+        series = cls()
+        series.timestamps.frombytes(timestamps)
+        series.prices.frombytes(prices)
+        return series
+
+    def to_blobs(self):
+        return self.timestamps.tobytes(), self.prices.tobytes()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def last_price(self):
+        return self.prices[-1] if self.prices else None
+
+    def append(self, ts, price_cents):
+        # Usually at the end; imports may carry older timestamps
+        index = bisect.bisect_right(self.timestamps, ts)
+        self.timestamps.insert(index, ts)
+        self.prices.insert(index, price_cents)
+
+    def price_at(self, ts):
+        index = bisect.bisect_right(self.timestamps, ts)
+        return self.prices[index - 1] if index else None
+
+    def between(self, start=None, end=None):
+        # Points with start <= ts < end, found by binary search
+        lo = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        hi = len(self.timestamps) if end is None else bisect.bisect_left(self.timestamps, end)
+        return list(zip(self.timestamps[lo:hi], self.prices[lo:hi]))
+
+
+def trend(rollups, period, buckets, now=None):
+    # Average price per bucket over the last `buckets` periods. Prices hold
+    # until they change, so a bucket without changes repeats the last known
+    # average; buckets before the first price are None.
+    # Buckets are stepped back one at a time: across a clock change they are
+    # an hour longer or shorter than the period.
+    starts = [bucket_start(int(now or time.time()), period)]
+    while len(starts) < buckets:
+        starts.append(bucket_start(starts[-1] - 1, period))
+    starts.reverse()
+    averages = {row['start']: row['total_cents'] / row['points'] for row in rollups}
+    earlier = [start for start in averages if start < starts[0]]
+    current = averages[max(earlier)] if earlier else None
+    values = []
+    for start in starts:
+        current = averages.get(start, current)
+        values.append(current)
+    return values
+
+
+def sparkline(values):
+    known = [value for value in values if value is not None]
+    if not known:
+        return ""
+    low, high = min(known), max(known)
+    if high == low:
+        # A flat line sits mid-height rather than reading as a drop to zero
+        return "".join(" " if value is None else SPARK_CHARS[len(SPARK_CHARS) // 2] for value in values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(" " if value is None else SPARK_CHARS[round((value - low) * scale)] for value in values)
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self, table):
+        # Entries carry the version of every table they read, so bumping a
+        # table makes its old entries unreachable; LRU eviction drops them.
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get_or_compute(self, name, tables, params, compute):
+        with self._lock:
+            key = (name, params, tuple(self._versions.get(table, 0) for table in tables))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
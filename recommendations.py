@@ -0,0 +1,271 @@
+import math
+import threading
+from collections import Counter
+
+import numpy as np
+
+from records import ProjectStatus
+from search_index import fold, tokenize
+
+TOP_K = 10
+# Projects scoring below this are left out even when a list has room; they
+# would show as a "0% match"
+MIN_SCORE = 0.05
+# Relative weight of each score component; they need not sum to one
+DEFAULT_WEIGHTS = (("text", 0.7), ("budget", 0.3))
+# Bid amounts are compared on a log scale. A contractor with a single bid
+# is assumed to take on work within about three times either side of it.
+MIN_SPREAD = math.log(3)
+# IDF weights are fixed when the model is built and refreshed once the
+# open projects have grown by this fraction since
+REBUILD_GROWTH = 0.25
+REBUILD_MIN_PROJECTS = 50
+# Size of the dense block scored at once when ranking many contractors
+CHUNK_CELLS = 2_000_000
+
+
+def project_terms(project):
+    # Type and location count as whole features, so "Commercial Office" does
+    # not partly match "Commercial Retail"
+    terms = Counter(tokenize(f"{project.title or ''} {project.description or ''}"))
+    terms[f"type:{fold(project.type or '')}"] += 1
+    terms[f"location:{fold(project.location or '')}"] += 1
+    return terms
+
+
+def bid_terms(bid, project):
+    # What a contractor has shown interest in: the projects they bid on and
+    # how they described their approach and experience
+    terms = Counter(tokenize(f"{bid.approach or ''} {bid.experience or ''}"))
+    if project is not None:
+        terms.update(project_terms(project))
+    return terms
+
+
+class SparseRows:
+    # Rows of a sparse matrix as CSR arrays, for multiplying many rows with a
+    # few dense vectors at once
+    def __init__(self, rows):
+        self.starts = np.zeros(len(rows) + 1, dtype=np.int64)
+        self.starts[1:] = np.cumsum([len(columns) for columns, _ in rows])
+        self.columns = np.concatenate([columns for columns, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        self.values = np.concatenate([values for _, values in rows]) if rows else np.zeros(0)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def dot(self, dense):
+        # dense is (n, vocabulary); returns (n, rows). Row sums come from a
+        # running total, which also gives empty rows a zero.
+        products = dense[:, self.columns] * self.values
+        totals = np.zeros((len(dense), len(self.columns) + 1))
+        np.cumsum(products, axis=1, out=totals[:, 1:])
+        return totals[:, self.starts[1:]] - totals[:, self.starts[:-1]]
+
+
+class Profile:
+    __slots__ = ("terms", "vector", "center", "spread", "bid_projects")
+
+    def __init__(self, terms, amounts, bid_projects):
+        self.terms = terms
+        self.vector = None
+        logs = np.log(np.maximum(amounts, 1))
+        self.center = float(logs.mean())
+        self.spread = max(float(logs.std()), MIN_SPREAD)
+        self.bid_projects = bid_projects
+
+
+class TenderMatcher:
+    # Recommends open projects to contractors. A contractor's profile is
+    # built from their bids: TF-IDF over the bid projects' words, type and
+    # location plus the bid's approach and experience, and the range of
+    # amounts they bid. Each open project is scored on cosine similarity of
+    # its words and on how well its budget fits that range.
+    #
+    # Scores are computed when something changes, never when recommendations
+    # are read: a new project is scored against every profile in one batch
+    # and enters the top-K lists it beats, and a contractor's new bid
+    # re-ranks only that contractor. recommended() is a dictionary lookup.
+    def __init__(self, top_k=TOP_K, weights=DEFAULT_WEIGHTS, min_score=MIN_SCORE):
+        self.top_k = top_k
+        self.min_score = min_score
+        weights = dict(weights)
+        total = sum(weights.values()) or 1.0
+        self.weights = {name: weight / total for name, weight in weights.items()}
+        self._lock = threading.Lock()
+        self._vocabulary = {}
+        self._document_counts = Counter()
+        self._documents = 0
+        self._built_projects = 0
+        self._projects = {}
+        self._profiles = {}
+        self._top = {}
+        self._project_matrix = None
+        self._profile_matrix = None
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def build(self, load):
+        # load() returns (projects, bids); it runs under the lock, so changes
+        # arriving meanwhile wait and are applied on top of what it read
+        with self._lock:
+            projects, bids = load()
+            projects = {project.id: project for project in projects}
+            self._projects = {project_id: (project_terms(project), None, project.budget_cents)
+                              for project_id, project in projects.items() if project.status == ProjectStatus.OPEN}
+            by_contractor = {}
+            for bid in bids:
+                if bid.user_id:
+                    by_contractor.setdefault(bid.user_id, []).append((bid, projects.get(bid.project_id)))
+            self._profiles = {user_id: self._profile(pairs) for user_id, pairs in by_contractor.items()}
+            self._rebuild()
+
+    def recommended(self, user_id):
+        # [(project_id, score)], best first
+        with self._lock:
+            return [(project_id, score) for score, project_id in self._top.get(user_id, [])]
+
+    def update_project(self, project_id, project):
+        # project is None once deleted; only open projects are recommended
+        with self._lock:
+            if project_id in self._projects:
+                self._remove_project(project_id)
+            if project is not None and project.status == ProjectStatus.OPEN:
+                self._add_projects([project])
+
+    def update_contractor(self, user_id, pairs):
+        # pairs are (bid, project) for every bid the contractor has made
+        with self._lock:
+            if not pairs:
+                self._profiles.pop(user_id, None)
+                self._top.pop(user_id, None)
+                self._profile_matrix = None
+                return
+            profile = self._profile(pairs)
+            profile.vector = self._vector(profile.terms)
+            self._profiles[user_id] = profile
+            self._profile_matrix = None
+            self._rank([user_id])
+
+    def _profile(self, pairs):
+        terms = Counter()
+        for bid, project in pairs:
+            terms.update(bid_terms(bid, project))
+        return Profile(terms, np.array([bid.amount_cents for bid, _ in pairs], dtype=float),
+                       {bid.project_id for bid, _ in pairs})
+
+    def _rebuild(self):
+        # Document frequencies come from the open projects, the corpus being
+        # recommended from
+        self._vocabulary = {}
+        self._document_counts = Counter()
+        for terms, _, _ in self._projects.values():
+            self._document_counts.update(terms.keys())
+        self._documents = self._built_projects = len(self._projects)
+        self._projects = {project_id: (terms, self._vector(terms), budget)
+                          for project_id, (terms, _, budget) in self._projects.items()}
+        for profile in self._profiles.values():
+            profile.vector = self._vector(profile.terms)
+        self._project_matrix = self._profile_matrix = None
+        self._top = {}
+        self._rank(list(self._profiles))
+
+    def _vector(self, terms):
+        # Sublinear term frequency times smoothed IDF, L2-normalised
+        columns = np.empty(len(terms), dtype=np.int64)
+        values = np.empty(len(terms))
+        for position, (term, count) in enumerate(terms.items()):
+            columns[position] = self._vocabulary.setdefault(term, len(self._vocabulary))
+            idf = math.log((1 + self._documents) / (1 + self._document_counts.get(term, 0))) + 1
+            values[position] = (1 + math.log(count)) * idf
+        norm = np.linalg.norm(values)
+        return columns, values / norm if norm else values
+
+    def _dense(self, vectors):
+        dense = np.zeros((len(vectors), len(self._vocabulary)))
+        for row, (columns, values) in enumerate(vectors):
+            dense[row, columns] = values
+        return dense
+
+    def _projects_compiled(self):
+        if self._project_matrix is None:
+            ids = list(self._projects)
+            self._project_matrix = (np.array(ids, dtype=np.int64),
+                                    SparseRows([self._projects[project_id][1] for project_id in ids]),
+                                    np.log(np.maximum([self._projects[project_id][2] or 1 for project_id in ids], 1)))
+        return self._project_matrix
+
+    def _profiles_compiled(self):
+        if self._profile_matrix is None:
+            user_ids = list(self._profiles)
+            profiles = [self._profiles[user_id] for user_id in user_ids]
+            self._profile_matrix = (user_ids, SparseRows([profile.vector for profile in profiles]),
+                                    np.array([profile.center for profile in profiles]),
+                                    np.array([profile.spread for profile in profiles]))
+        return self._profile_matrix
+
+    def _score(self, text, log_budgets, centers, spreads):
+        # text is (n, m) cosine similarity; the budget term is a Gaussian of
+        # the distance from the contractor's usual amount, in their spreads
+        budget = np.exp(-0.5 * ((log_budgets - centers) / spreads) ** 2)
+        return self.weights.get("text", 0.0) * text + self.weights.get("budget", 0.0) * budget
+
+    def _rank(self, user_ids):
+        # Full top-K for some contractors against every open project, a
+        # chunk of contractors at a time
+        project_ids, matrix, log_budgets = self._projects_compiled()
+        if not len(project_ids):
+            self._top.update({user_id: [] for user_id in user_ids})
+            return
+        chunk = max(1, CHUNK_CELLS // max(len(matrix.columns), len(self._vocabulary), 1))
+        for start in range(0, len(user_ids), chunk):
+            batch = [self._profiles[user_id] for user_id in user_ids[start:start + chunk]]
+            text = matrix.dot(self._dense([profile.vector for profile in batch]))
+            scores = self._score(text, log_budgets[None, :], np.array([[profile.center] for profile in batch]),
+                                 np.array([[profile.spread] for profile in batch]))
+            for user_id, profile, row in zip(user_ids[start:start + chunk], batch, scores):
+                if profile.bid_projects:
+                    row[np.isin(project_ids, list(profile.bid_projects))] = -np.inf
+                count = min(self.top_k, len(row))
+                best = np.argpartition(-row, count - 1)[:count]
+                best = best[np.lexsort((project_ids[best], -row[best]))]
+                # Projects already bid on are at -inf and fall below the minimum too
+                self._top[user_id] = [(float(row[index]), int(project_ids[index])) for index in best
+                                      if row[index] >= self.min_score]
+
+    def _add_projects(self, projects):
+        for project in projects:
+            terms = project_terms(project)
+            self._projects[project.id] = (terms, self._vector(terms), project.budget_cents)
+        self._project_matrix = None
+        if len(self._projects) >= max(self._built_projects * (1 + REBUILD_GROWTH),
+                                      self._built_projects + REBUILD_MIN_PROJECTS):
+            self._rebuild()
+            return
+        if not self._profiles:
+            return
+        # The new projects against every profile in one batch
+        user_ids, matrix, centers, spreads = self._profiles_compiled()
+        vectors = [self._projects[project.id][1] for project in projects]
+        text = matrix.dot(self._dense(vectors))
+        log_budgets = np.log(np.maximum([project.budget_cents or 1 for project in projects], 1))
+        scores = self._score(text, log_budgets[:, None], centers[None, :], spreads[None, :])
+        floors = np.array([top[-1][0] if len(top) >= self.top_k else -np.inf
+                           for top in (self._top.get(user_id, []) for user_id in user_ids)])
+        for row, column in zip(*np.nonzero((scores > floors[None, :]) & (scores >= self.min_score))):
+            user_id, project_id = user_ids[column], projects[row].id
+            if project_id in self._profiles[user_id].bid_projects:
+                continue
+            top = self._top.setdefault(user_id, [])
+            top.append((float(scores[row, column]), project_id))
+            top.sort(key=lambda entry: (-entry[0], entry[1]))
+            del top[self.top_k:]
+
+    def _remove_project(self, project_id):
+        del self._projects[project_id]
+        self._project_matrix = None
+        # Contractors who had it in their list get a full re-rank to refill it
+        affected = [user_id for user_id, top in self._top.items()
+                    if any(entry[1] == project_id for entry in top)]
+        self._rank(affected)
@@ -0,0 +1,155 @@
+import datetime
+import enum
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+
+class ProjectStatus(enum.StrEnum):
+    OPEN = "Open"
+    AWARDED = "Awarded"
+    CLOSED = "Closed"
+
+
+class BidStatus(enum.StrEnum):
+    SUBMITTED = "Submitted"
+    UNDER_REVIEW = "Under Review"
+    AWARDED = "Awarded"
+    NOT_SELECTED = "Not Selected"
+    PENDING = "Pending"
+
+
+class OrderStatus(enum.StrEnum):
+    PENDING = "Pending"
+    CONFIRMED = "Confirmed"
+    IN_TRANSIT = "In Transit"
+    DELIVERED = "Delivered"
+    CANCELLED = "Cancelled"
+
+
+class FileStatus(enum.StrEnum):
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class Availability(enum.StrEnum):
+    IN_STOCK = "In Stock"
+    LIMITED_STOCK = "Limited Stock"
+    OUT_OF_STOCK = "Out of Stock"
+    AVAILABLE_ON_ORDER = "Available on Order"
+
+
+MAX_CENTS = 2 ** 63 - 1
+MIN_CENTS = -2 ** 63
+
+# A tracked material shows Limited Stock once fewer than this many minimum
+# orders are left, and Out of Stock once not even one is
+LIMITED_STOCK_ORDERS = 10
+
+
+def stock_availability(stock, minimum_order):
+    minimum_order = max(minimum_order or 1, 1)
+    if stock < minimum_order:
+        return Availability.OUT_OF_STOCK
+    if stock < LIMITED_STOCK_ORDERS * minimum_order:
+        return Availability.LIMITED_STOCK
+    return Availability.IN_STOCK
+
+
+def to_cents(amount):
+    # Decimal avoids 0.1 + 0.2 style drift when "12.75" comes from a form.
+    # Raises ValueError, like float() does for bad input, for inf, nan and
+    # amounts that do not fit SQLite's 64-bit integers.
+    amount = Decimal(str(amount))
+    if not amount.is_finite():
+        raise ValueError(f"Not a finite amount: {amount}")
+    cents = int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    if not MIN_CENTS <= cents <= MAX_CENTS:
+        raise ValueError(f"Amount out of range: {amount}")
+    return cents
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+def format_money(cents):
+    return f"${cents / 100:,.2f}"
+
+
+def now_ts():
+    return int(time.time())
+
+
+def date_to_ts(date):
+    return int(datetime.datetime.combine(date, datetime.time.min).timestamp())
+
+
+def format_date(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d") if ts is not None else ""
+
+
+def format_datetime(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") if ts is not None else ""
+
+
+class Record:
+    __slots__ = ()
+    # Fields that hold an enum, and fields whose default is a fresh list
+    ENUMS = {}
+    LISTS = ()
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            value = values.get(field)
+            if value is None and field in self.LISTS:
+                value = []
+            elif value is not None and field in self.ENUMS:
+                value = self.ENUMS[field](value)
+            setattr(self, field, value)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def as_row(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self.id!r})"
+
+
+class Project(Record):
+    __slots__ = ("id", "title", "location", "type", "budget_cents", "description", "status", "posted_at",
+                 "files_status", "user_id", "files", "bids")
+    ENUMS = {"status": ProjectStatus, "files_status": FileStatus}
+    LISTS = ("files", "bids")
+
+
+class Bid(Record):
+    __slots__ = ("id", "project_id", "amount_cents", "timeline", "contractor", "contact", "phone", "email",
+                 "license", "approach", "experience", "submitted_at", "status", "status_history", "notes",
+                 "user_id", "files_status", "files", "project_title", "project_location")
+    ENUMS = {"status": BidStatus, "files_status": FileStatus}
+    LISTS = ("status_history", "files")
+
+
+class Material(Record):
+    __slots__ = ("id", "name", "category", "subcategory", "supplier", "price_cents", "availability", "location",
+                 "contact", "minimum_order", "updated_at", "latitude", "longitude", "stock")
+    ENUMS = {"availability": Availability}
+
+
+class Order(Record):
+    __slots__ = ("id", "order_id", "material", "supplier", "quantity", "price_per_unit_cents", "total_cents",
+                 "delivery_at", "delivery_address", "project_name", "instructions", "status", "ordered_at",
+                 "updated_at", "contact_person", "contact_phone", "user_id", "purchase_order", "material_id")
+    ENUMS = {"status": OrderStatus}
+
+
+TABLE_RECORDS = {"projects": Project, "bids": Bid, "materials": Material, "orders": Order}
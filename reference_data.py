@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from records import Availability, BidStatus, OrderStatus, ProjectStatus
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_data.json")
+
+
+class ReferenceData:
+    # One immutable copy per process, shared by every session. The option
+    # lists the filters show are built here once rather than on every rerun.
+    __slots__ = ("version", "categories", "project_types", "locations", "statuses", "category_filter",
+                 "project_type_filter", "project_location_filter", "material_location_filter",
+                 "availability_filter")
+
+    def __init__(self, version, categories, project_types, locations):
+        self.version = version
+        self.categories = MappingProxyType({name: tuple(subcategories)
+                                            for name, subcategories in categories.items()})
+        self.project_types = tuple(project_types)
+        self.locations = tuple(locations)
+        # Statuses are fixed by the records; listed here so screens have one place to look
+        self.statuses = MappingProxyType({"project": tuple(ProjectStatus), "bid": tuple(BidStatus),
+                                          "order": tuple(OrderStatus), "availability": tuple(Availability)})
+        self.category_filter = ("All Categories",) + tuple(self.categories)
+        self.project_type_filter = ("All",) + self.project_types
+        self.project_location_filter = ("All",) + self.locations + ("Other",)
+        self.material_location_filter = ("All",) + self.locations
+        self.availability_filter = ("All",) + self.statuses["availability"]
+
+
+def load(path=DEFAULT_PATH):
+    # Raises ValueError with a readable message when the file is malformed
+    with open(path, encoding="utf-8") as config:
+        try:
+            data = json.load(config)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} is not valid JSON: {e}") from e
+    if not isinstance(data.get("version"), int):
+        raise ValueError(f"{path} needs an integer version")
+    categories = data.get("categories")
+    if not isinstance(categories, dict) or not all(isinstance(subcategories, list) and subcategories
+                                                   for subcategories in categories.values()):
+        raise ValueError(f"{path}: categories must map each category to a list of subcategories")
+    for field in ("project_types", "locations"):
+        if not isinstance(data.get(field), list) or not data[field]:
+            raise ValueError(f"{path}: {field} must be a non-empty list")
+    return ReferenceData(data["version"], categories, data["project_types"], data["locations"])
+
+
+class ReferenceRegistry:
+    # Serves the current ReferenceData and hot-reloads the config file. The
+    # file is looked at no more than once per check_interval, and a new copy
+    # is published only when its version changes, so a file caught
+    # half-saved, or edited without bumping the version, never goes live.
+    # A broken file keeps the previous copy in place.
+    def __init__(self, path=DEFAULT_PATH, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current = load(path)
+        self._mtime = os.stat(path).st_mtime_ns
+        self._checked = time.monotonic()
+
+    def get(self):
+        if time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked >= self.check_interval:
+                    self._checked = time.monotonic()
+                    self._reload()
+        return self._current
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            LOGGER.warning("Reference data %s is missing; keeping version %d", self.path, self._current.version)
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            data = load(self.path)
+        except (OSError, ValueError) as e:
+            LOGGER.error("Could not reload reference data (%s); keeping version %d", e, self._current.version)
+            return
+        if data.version == self._current.version:
+            LOGGER.warning("%s changed but is still version %d; bump the version to publish it", self.path,
+                           data.version)
+            return
+        LOGGER.info("Reference data version %d replaces version %d", data.version, self._current.version)
+        self._current = data
@@ -0,0 +1,67 @@
+"""Run several Streamlit server processes on one marketplace database.
+
+Each worker listens on its own port with PANAMA_MULTIPROCESS=1, so
+sessions are stored in the database under the ?sid= query parameter and
+every worker follows the others' writes through the change feed. Any
+load balancer can spread requests over the ports, with or without sticky
+sessions, e.g. for nginx:
+
+    upstream panama {
+        server 127.0.0.1:8501;
+        server 127.0.0.1:8502;
+    }
+    # plus proxy_http_version 1.1 and the Upgrade/Connection headers
+    # Streamlit's websocket needs
+
+    python run_workers.py --workers 4 --base-port 8501
+
+All workers must share PANAMA_DATA_DIR on a local disk; SQLite's WAL mode
+does not work over network filesystems.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--base-port", type=int, default=8501, help="worker i listens on base-port + i")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--data-dir", help="shared data directory (default: PANAMA_DATA_DIR or ./data)")
+    args = parser.parse_args()
+    env = dict(os.environ, PANAMA_MULTIPROCESS="1")
+    if args.data_dir:
+        env["PANAMA_DATA_DIR"] = os.path.abspath(args.data_dir)
+    workers = []
+    for index in range(args.workers):
+        port = args.base_port + index
+        workers.append(subprocess.Popen([
+            sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "Construccionpa.py"),
+            "--server.port", str(port), "--server.address", args.address, "--server.headless", "true",
+        ], env=env))
+        print(f"worker {index} on http://{args.address}:{port}", flush=True)
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # A worker that dies takes the others down with it, so a supervisor
+    # (systemd, docker) sees the failure and restarts the set
+    while workers:
+        pid, status = os.wait()
+        exited = [worker for worker in workers if worker.pid == pid]
+        workers = [worker for worker in workers if worker.pid != pid]
+        if exited and status:
+            stop(None, None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
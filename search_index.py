@@ -0,0 +1,112 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+TOKEN_RE = re.compile(r"\w+")
+PREFIX_WEIGHT = 0.5
+
+PROJECT_SEARCH_FIELDS = {"title": 3.0, "type": 1.5, "location": 1.5, "description": 1.0}
+MATERIAL_SEARCH_FIELDS = {"name": 3.0, "supplier": 2.0, "category": 1.5, "subcategory": 1.5}
+
+
+def fold(text):
+    # "Tubería" and "tuberia" must meet on the same term
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+class InvertedIndex:
+    def __init__(self, fields):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._terms = []
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc_id, record):
+        weights = {}
+        for field, weight in self.fields.items():
+            for token in tokenize(str(record.get(field) or "")):
+                weights[token] = weights.get(token, 0.0) + weight
+        with self._lock:
+            self._remove(doc_id)
+            self._documents[doc_id] = weights
+            for term, weight in weights.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    bisect.insort(self._terms, term)
+                postings[doc_id] = weight
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for term in self._documents.pop(doc_id, {}):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _expand(self, token):
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + "\uffff", start)
+        return self._terms[start:end]
+
+    def search(self, query, limit=None):
+        # Every query token must match a term exactly or as a prefix; exact
+        # matches and rarer terms rank higher. Returns None for an empty query
+        # so callers can tell "no text filter" from "no hits".
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        with self._lock:
+            total = len(self._documents) or 1
+            matches = []
+            for token in dict.fromkeys(tokens):
+                terms = []
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    terms.append((postings, idf if term == token else idf * PREFIX_WEIGHT))
+                if not terms:
+                    return []
+                matches.append((sum(len(postings) for postings, _ in terms), terms))
+            # Start from the most selective token and only probe its candidates
+            # against the remaining tokens' postings.
+            matches.sort(key=lambda match: match[0])
+            scores = {}
+            for postings, idf in matches[0][1]:
+                for doc_id, weight in postings.items():
+                    score = weight * idf
+                    if score > scores.get(doc_id, 0.0):
+                        scores[doc_id] = score
+            for _, terms in matches[1:]:
+                narrowed = {}
+                for doc_id, score in scores.items():
+                    best = 0.0
+                    for postings, idf in terms:
+                        weight = postings.get(doc_id)
+                        if weight is not None and weight * idf > best:
+                            best = weight * idf
+                    if best:
+                        narrowed[doc_id] = score + best
+                scores = narrowed
+                if not scores:
+                    return []
+        key = lambda doc_id: (-scores[doc_id], doc_id)
+        if limit:
+            return heapq.nsmallest(limit, scores, key=key)
+        return sorted(scores, key=key)
@@ -0,0 +1,1040 @@
+import datetime
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from blobstore import BlobStore
+from geo import geocode
+from ids import ulid
+from price_history import PERIODS, PriceSeries, bucket_start
+from records import TABLE_RECORDS, OrderStatus, now_ts, stock_availability
+
+
+# Folds one price point into its bucket
+PRICE_ROLLUP_UPSERT = (
+    "INSERT INTO price_rollups (material_id, period, start, min_cents, max_cents, total_cents, points) "
+    "VALUES (?, ?, ?, ?, ?, ?, 1) ON CONFLICT (material_id, period, start) DO UPDATE SET "
+    "min_cents = min(min_cents, excluded.min_cents), max_cents = max(max_cents, excluded.max_cents), "
+    "total_cents = total_cents + excluded.total_cents, points = points + 1"
+)
+
+
+def _move_file_data_to_blobs(store, conn):
+    conn.execute("ALTER TABLE files ADD COLUMN sha256 TEXT")
+    conn.execute("ALTER TABLE files ADD COLUMN size INTEGER")
+    for row in conn.execute("SELECT id, data FROM files").fetchall():
+        handle = store.blobs.put(io.BytesIO(row['data']))
+        conn.execute("UPDATE files SET sha256 = ?, size = ? WHERE id = ?",
+                     (handle['sha256'], handle['size'], row['id']))
+    conn.execute("ALTER TABLE files DROP COLUMN data")
+
+
+def _locate(fields):
+    # Materials carry the coordinates of the gazetteer place their location
+    # names; an unknown place clears them rather than keeping stale ones
+    if "location" in fields and fields.get("latitude") is None:
+        place = geocode(fields["location"])
+        fields = dict(fields, latitude=place and place.latitude, longitude=place and place.longitude)
+    return fields
+
+
+def _stocked(fields):
+    # A material with a stock count takes its availability from it
+    if fields.get("stock") is None:
+        return fields
+    return dict(fields, availability=stock_availability(fields["stock"], fields.get("minimum_order")))
+
+
+def _run_script(conn, script):
+    for statement in script.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _use_cents_and_timestamps(store, conn):
+    # Money becomes integer cents and dates become epoch seconds; the old
+    # text dates were written in server local time.
+    _run_script(conn, """
+    ALTER TABLE projects ADD COLUMN budget_cents INTEGER;
+    ALTER TABLE projects ADD COLUMN posted_at INTEGER;
+    UPDATE projects SET budget_cents = CAST(ROUND(budget * 100) AS INTEGER),
+                        posted_at = CAST(strftime('%s', date_posted, 'utc') AS INTEGER);
+    ALTER TABLE projects DROP COLUMN budget;
+    ALTER TABLE projects DROP COLUMN date_posted;
+    ALTER TABLE bids ADD COLUMN amount_cents INTEGER;
+    ALTER TABLE bids ADD COLUMN submitted_at INTEGER;
+    UPDATE bids SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER),
+                    submitted_at = CAST(strftime('%s', date, 'utc') AS INTEGER);
+    ALTER TABLE bids DROP COLUMN amount;
+    ALTER TABLE bids DROP COLUMN date;
+    ALTER TABLE materials ADD COLUMN price_cents INTEGER;
+    ALTER TABLE materials ADD COLUMN updated_at INTEGER;
+    UPDATE materials SET price_cents = CAST(ROUND(price * 100) AS INTEGER),
+                         updated_at = CAST(strftime('%s', last_updated, 'utc') AS INTEGER);
+    ALTER TABLE materials DROP COLUMN price;
+    ALTER TABLE materials DROP COLUMN last_updated;
+    ALTER TABLE orders ADD COLUMN price_per_unit_cents INTEGER;
+    ALTER TABLE orders ADD COLUMN total_cents INTEGER;
+    ALTER TABLE orders ADD COLUMN delivery_at INTEGER;
+    ALTER TABLE orders ADD COLUMN ordered_at INTEGER;
+    ALTER TABLE orders ADD COLUMN updated_at INTEGER;
+    UPDATE orders SET price_per_unit_cents = CAST(ROUND(price_per_unit * 100) AS INTEGER),
+                      total_cents = CAST(ROUND(total_price * 100) AS INTEGER),
+                      delivery_at = CAST(strftime('%s', delivery_date, 'utc') AS INTEGER),
+                      ordered_at = CAST(strftime('%s', order_date, 'utc') AS INTEGER),
+                      updated_at = CAST(strftime('%s', last_updated, 'utc') AS INTEGER);
+    ALTER TABLE orders DROP COLUMN price_per_unit;
+    ALTER TABLE orders DROP COLUMN total_price;
+    ALTER TABLE orders DROP COLUMN delivery_date;
+    ALTER TABLE orders DROP COLUMN order_date;
+    ALTER TABLE orders DROP COLUMN last_updated
+    """)
+    for row in conn.execute("SELECT id, status_history FROM bids").fetchall():
+        history = json.loads(row['status_history'])
+        for entry in history:
+            date = entry.pop('date', None)
+            entry['at'] = int(datetime.datetime.strptime(date, "%Y-%m-%d").timestamp()) if date else None
+        conn.execute("UPDATE bids SET status_history = ? WHERE id = ?", (json.dumps(history), row['id']))
+
+
+def _add_price_history(store, conn):
+    conn.execute("""
+        CREATE TABLE price_series (
+            material_id INTEGER PRIMARY KEY REFERENCES materials(id),
+            timestamps BLOB NOT NULL,
+            prices BLOB NOT NULL
+        )""")
+    # Clustered on the key so one material's buckets are read in order
+    conn.execute("""
+        CREATE TABLE price_rollups (
+            material_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            min_cents INTEGER NOT NULL,
+            max_cents INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            PRIMARY KEY (material_id, period, start)
+        ) WITHOUT ROWID""")
+    # Each material starts its history with the price it has now
+    for row in conn.execute("SELECT id, price_cents, updated_at FROM materials "
+                            "WHERE price_cents IS NOT NULL").fetchall():
+        store._record_price(conn, row['id'], row['updated_at'] or 0, row['price_cents'])
+
+
+def _add_coordinates(store, conn):
+    conn.execute("ALTER TABLE materials ADD COLUMN latitude REAL")
+    conn.execute("ALTER TABLE materials ADD COLUMN longitude REAL")
+    for row in conn.execute("SELECT id, location FROM materials").fetchall():
+        place = geocode(row['location'])
+        if place is not None:
+            conn.execute("UPDATE materials SET latitude = ?, longitude = ? WHERE id = ?",
+                         (place.latitude, place.longitude, row['id']))
+
+
+def _add_event_index(store, conn):
+    # Which logged events belong to which record, so one record's history
+    # reads only its own lines
+    conn.execute("""
+        CREATE TABLE event_index (
+            tbl TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (tbl, record_id, seq)
+        ) WITHOUT ROWID
+    """)
+    if store.event_log is not None:
+        store.event_log.flush()
+        conn.executemany("INSERT OR IGNORE INTO event_index (tbl, record_id, seq) VALUES (?, ?, ?)",
+                         ((event['table'], event['id'], event['seq']) for event in store.event_log.events()))
+
+
+def _rekey_price_rollups(store, conn):
+    # Buckets next to a clock change were keyed an hour off; refold every
+    # stored price under the corrected bucket starts
+    conn.execute("DELETE FROM price_rollups")
+    for row in conn.execute("SELECT material_id, timestamps, prices FROM price_series").fetchall():
+        series = PriceSeries.from_blobs(row['timestamps'], row['prices'])
+        for ts, price_cents in zip(series.timestamps, series.prices):
+            for period in PERIODS:
+                conn.execute(PRICE_ROLLUP_UPSERT, (row['material_id'], period, bucket_start(ts, period),
+                                                   price_cents, price_cents, price_cents))
+
+
+# Recomputes every rollup table from the raw rows; used once when the rollups
+# were introduced and again after an event log replay
+ORDER_AND_BID_ROLLUP_REBUILD = """
+    DELETE FROM order_rollups;
+    DELETE FROM material_order_rollups;
+    DELETE FROM bid_rollups;
+    INSERT INTO order_rollups
+        SELECT supplier, status, strftime('%Y-%m', ordered_at, 'unixepoch', 'localtime'), COUNT(*), SUM(total_cents)
+        FROM orders GROUP BY 1, 2, 3;
+    INSERT INTO material_order_rollups
+        SELECT supplier, material, COUNT(*), SUM(quantity), SUM(total_cents) FROM orders
+        WHERE status != 'Cancelled' GROUP BY 1, 2;
+    INSERT INTO bid_rollups
+        SELECT project_id, COUNT(*), SUM(amount_cents), MIN(amount_cents), MAX(amount_cents) FROM bids GROUP BY 1;
+"""
+# Per developer; projects posted before they had an owner count under ''
+PROJECT_TYPE_ROLLUP_REBUILD = """
+    DELETE FROM project_type_rollups;
+    INSERT INTO project_type_rollups
+        SELECT COALESCE(user_id, ''), type, COUNT(*), COALESCE(SUM(bid_rollups.bids), 0),
+               COALESCE(SUM(bid_rollups.total_cents), 0)
+        FROM projects LEFT JOIN bid_rollups ON bid_rollups.project_id = projects.id GROUP BY 1, 2;
+"""
+ROLLUP_REBUILD = ORDER_AND_BID_ROLLUP_REBUILD + PROJECT_TYPE_ROLLUP_REBUILD
+
+# Each entry upgrades the schema by one PRAGMA user_version step, either as a
+# SQL script or as a callable taking (store, connection).
+MIGRATIONS = [
+    """
+    CREATE TABLE projects (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        location TEXT NOT NULL,
+        type TEXT NOT NULL,
+        budget REAL NOT NULL,
+        description TEXT NOT NULL,
+        status TEXT NOT NULL,
+        date_posted TEXT NOT NULL
+    );
+    CREATE TABLE bids (
+        id INTEGER PRIMARY KEY,
+        project_id INTEGER NOT NULL REFERENCES projects(id),
+        amount REAL NOT NULL,
+        timeline INTEGER NOT NULL,
+        contractor TEXT NOT NULL,
+        contact TEXT,
+        phone TEXT,
+        email TEXT,
+        license TEXT,
+        approach TEXT,
+        experience TEXT,
+        date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        status_history TEXT NOT NULL DEFAULT '[]',
+        notes TEXT NOT NULL DEFAULT '',
+        user_id TEXT
+    );
+    CREATE TABLE materials (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        subcategory TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        price REAL NOT NULL,
+        availability TEXT NOT NULL,
+        location TEXT NOT NULL,
+        contact TEXT,
+        minimum_order INTEGER NOT NULL,
+        last_updated TEXT
+    );
+    CREATE TABLE orders (
+        id INTEGER PRIMARY KEY,
+        order_id TEXT NOT NULL UNIQUE,
+        material TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price_per_unit REAL NOT NULL,
+        total_price REAL NOT NULL,
+        delivery_date TEXT NOT NULL,
+        delivery_address TEXT,
+        project_name TEXT,
+        instructions TEXT,
+        status TEXT NOT NULL,
+        order_date TEXT NOT NULL,
+        last_updated TEXT,
+        contact_person TEXT,
+        contact_phone TEXT,
+        user_id TEXT
+    );
+    CREATE TABLE files (
+        id INTEGER PRIMARY KEY,
+        owner_type TEXT NOT NULL,
+        owner_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT,
+        data BLOB NOT NULL
+    );
+    CREATE INDEX idx_bids_project ON bids(project_id);
+    CREATE INDEX idx_files_owner ON files(owner_type, owner_id);
+    """,
+    _move_file_data_to_blobs,
+    """
+    CREATE INDEX idx_bids_user ON bids(user_id, status);
+    CREATE INDEX idx_orders_user ON orders(user_id, status);
+    CREATE INDEX idx_orders_supplier ON orders(supplier, status);
+    CREATE INDEX idx_materials_supplier ON materials(supplier, category, availability);
+    """,
+    """
+    CREATE INDEX idx_materials_supplier_name ON materials(supplier, name);
+    """,
+    _use_cents_and_timestamps,
+    """
+    CREATE TABLE sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT INTO sequences (name, value)
+        SELECT 'orders', COALESCE(MAX(CAST(substr(order_id, 5) AS INTEGER)), 0) FROM orders;
+    """,
+    """
+    ALTER TABLE projects ADD COLUMN files_status TEXT NOT NULL DEFAULT 'ready';
+    ALTER TABLE bids ADD COLUMN files_status TEXT NOT NULL DEFAULT 'ready';
+    ALTER TABLE files ADD COLUMN thumbnail TEXT;
+    ALTER TABLE files ADD COLUMN error TEXT;
+    """,
+    """
+    CREATE TABLE order_rollups (
+        supplier TEXT NOT NULL,
+        status TEXT NOT NULL,
+        month TEXT NOT NULL,
+        orders INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        PRIMARY KEY (supplier, status, month)
+    );
+    CREATE TABLE material_order_rollups (
+        supplier TEXT NOT NULL,
+        material TEXT NOT NULL,
+        orders INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        PRIMARY KEY (supplier, material)
+    );
+    CREATE TABLE bid_rollups (
+        project_id INTEGER PRIMARY KEY REFERENCES projects(id),
+        bids INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        min_cents INTEGER NOT NULL,
+        max_cents INTEGER NOT NULL
+    );
+    CREATE TABLE project_type_rollups (
+        type TEXT PRIMARY KEY,
+        projects INTEGER NOT NULL,
+        bids INTEGER NOT NULL,
+        bid_total_cents INTEGER NOT NULL
+    );
+    """ + ORDER_AND_BID_ROLLUP_REBUILD,
+    _add_price_history,
+    _add_coordinates,
+    """
+    ALTER TABLE orders ADD COLUMN purchase_order TEXT;
+    CREATE INDEX idx_orders_purchase_order ON orders(purchase_order);
+    """,
+    """
+    CREATE TABLE change_feed (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin TEXT NOT NULL,
+        tbl TEXT NOT NULL,
+        record_id INTEGER NOT NULL,
+        at INTEGER NOT NULL
+    );
+    CREATE INDEX idx_change_feed_at ON change_feed(at);
+    CREATE TABLE sessions (
+        sid TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at INTEGER NOT NULL
+    );
+    CREATE INDEX idx_sessions_updated ON sessions(updated_at);
+    """,
+    # NULL stock means the supplier sets availability by hand
+    """
+    ALTER TABLE materials ADD COLUMN stock INTEGER CHECK (stock >= 0);
+    ALTER TABLE orders ADD COLUMN material_id INTEGER;
+    """,
+    _add_event_index,
+    # Cancelled orders no longer count towards per-material sales
+    """
+    DELETE FROM material_order_rollups;
+    INSERT INTO material_order_rollups
+        SELECT supplier, material, COUNT(*), SUM(quantity), SUM(total_cents) FROM orders
+        WHERE status != 'Cancelled' GROUP BY 1, 2;
+    """,
+    # Projects belong to the developer who posted them and a company name to
+    # the first session that registered it
+    """
+    ALTER TABLE projects ADD COLUMN user_id TEXT;
+    CREATE INDEX idx_projects_user ON projects(user_id);
+    CREATE TABLE suppliers (
+        name TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL
+    );
+    DROP TABLE project_type_rollups;
+    CREATE TABLE project_type_rollups (
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        projects INTEGER NOT NULL,
+        bids INTEGER NOT NULL,
+        bid_total_cents INTEGER NOT NULL,
+        PRIMARY KEY (user_id, type)
+    );
+    """ + PROJECT_TYPE_ROLLUP_REBUILD,
+    _rekey_price_rollups,
+]
+
+LOGGER = logging.getLogger(__name__)
+
+JSON_COLUMNS = {"status_history"}
+OWNER_TABLES = {"project": "projects", "bid": "bids"}
+SQL_VARIABLE_LIMIT = 900
+# Tables whose changes reach the listeners of other processes
+FEED_TABLES = ("projects", "bids", "materials", "orders")
+CHANGE_FEED_RETENTION = 24 * 60 * 60
+SESSION_RETENTION = 30 * 24 * 60 * 60
+# How often a writing process drops expired change_feed and sessions rows
+PRUNE_INTERVAL = 60 * 60
+# Records whose history is kept parsed in memory
+HISTORY_CACHE_SIZE = 256
+
+
+class MarketplaceStore:
+    def __init__(self, path, blob_dir=None, event_log=None, change_feed=False):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.blobs = BlobStore(blob_dir or os.path.join(os.path.dirname(os.path.abspath(path)), "blobs"))
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._columns = {}
+        self._listeners = []
+        self._pending = []
+        self.event_log = event_log
+        self._events = []
+        self._history = {}
+        # With several processes on one database, every commit also lists its
+        # changed rows in change_feed; sync() hands other processes' rows to
+        # this process's listeners
+        self.change_feed = change_feed
+        self.origin = ulid()
+        self._next_prune = None
+        self._migrate()
+        if change_feed:
+            with self.transaction() as conn:
+                self._prune(conn)
+                self._feed_seen = self._feed_last(conn)
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _migrate(self):
+        with self.transaction():
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            for step, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                if callable(script):
+                    script(self, self._conn)
+                else:
+                    _run_script(self._conn, script)
+                self._conn.execute(f"PRAGMA user_version = {step}")
+        for table in ("projects", "bids", "materials", "orders", "files"):
+            self._columns[table] = [row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self._conn
+                finally:
+                    self._depth -= 1
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield self._conn
+                if self._events:
+                    # Numbered in the same transaction, so event order is commit order
+                    last = self.next_id("events", len(self._events))
+                    for seq, event in enumerate(self._events, start=last - len(self._events) + 1):
+                        event['seq'] = seq
+                    self._conn.executemany("INSERT INTO event_index (tbl, record_id, seq) VALUES (?, ?, ?)",
+                                           [(event['table'], event['id'], event['seq']) for event in self._events])
+                if self.change_feed and self._pending:
+                    at = now_ts()
+                    self._conn.executemany(
+                        "INSERT INTO change_feed (origin, tbl, record_id, at) VALUES (?, ?, ?, ?)",
+                        [(self.origin, table, record_id, at) for table, record_id in self._pending
+                         if table in FEED_TABLES])
+                if self._next_prune is not None and now_ts() >= self._next_prune:
+                    self._prune(self._conn)
+            except BaseException:
+                # SQLite may already have rolled back on its own (I/O errors, full disk)
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                self._pending.clear()
+                self._events.clear()
+                raise
+            else:
+                self._conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+            changes, self._pending = self._pending, []
+            events, self._events = self._events, []
+        if events:
+            self.event_log.append(events)
+        # Listeners run after the commit and outside the lock, so they only
+        # ever see durable rows and may read back through the store.
+        self._notify(changes)
+
+    def _notify(self, changes):
+        # A failing listener is logged rather than raised: the write has
+        # already committed, and the listeners after it still need to run.
+        for table, record_id in changes:
+            for listener in list(self._listeners):
+                try:
+                    listener(table, record_id)
+                except Exception:
+                    LOGGER.exception("Listener %r failed for %s %s", listener, table, record_id)
+
+    def _prune(self, conn):
+        # Runs inside a write transaction, at start-up and then at most once
+        # per PRUNE_INTERVAL, so long-running servers do not grow these tables
+        at = now_ts()
+        conn.execute("DELETE FROM change_feed WHERE at < ?", (at - CHANGE_FEED_RETENTION,))
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (at - SESSION_RETENTION,))
+        self._next_prune = at + PRUNE_INTERVAL
+
+    def sync(self):
+        # Runs this process's listeners for rows other processes committed
+        # since the last call. PRAGMA data_version only moves when another
+        # connection commits, so while nothing happens this is one pragma.
+        if not self.change_feed:
+            return 0
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return 0
+            self._data_version = version
+            # One read transaction, so the rows and the last seq agree
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute("SELECT seq, origin, tbl, record_id FROM change_feed WHERE seq > ? "
+                                          "ORDER BY seq", (self._feed_seen,)).fetchall()
+                last = self._feed_last(self._conn)
+            finally:
+                self._conn.execute("COMMIT")
+            # Sequence numbers have no holes, so rows missing before the first
+            # one returned were pruned
+            gap = last > self._feed_seen and (not rows or rows[0]['seq'] > self._feed_seen + 1)
+            self._feed_seen = max(last, self._feed_seen)
+        if gap:
+            # Idle past the retention window: what this process missed is
+            # gone from the feed, so every row is announced again
+            LOGGER.warning("Change feed moved past this process; resyncing %s", ", ".join(FEED_TABLES))
+            changes = [(table, record_id) for table in FEED_TABLES for record_id in self.list_ids(table)]
+        else:
+            changes = [(row['tbl'], row['record_id']) for row in rows if row['origin'] != self.origin]
+        self._notify(changes)
+        return len(changes)
+
+    def _feed_last(self, conn):
+        # AUTOINCREMENT keeps the highest seq ever used, even once pruned
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_feed'").fetchone()
+        return row[0] if row else 0
+
+    def claim_supplier(self, name, user_id):
+        # A company name belongs to the first user who registers it; True
+        # when that is this user
+        with self.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO suppliers (name, user_id) VALUES (?, ?)", (name, user_id))
+            return conn.execute("SELECT user_id FROM suppliers WHERE name = ?", (name,)).fetchone()[0] == user_id
+
+    def load_session(self, sid):
+        rows = self._query("SELECT state FROM sessions WHERE sid = ?", (sid,))
+        return json.loads(rows[0]['state']) if rows else None
+
+    def save_session(self, sid, state):
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO sessions (sid, state, updated_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT (sid) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                         (sid, json.dumps(state), now_ts()))
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [self._decode(row) for row in self._conn.execute(sql, params)]
+
+    def _query_in(self, sql, values, params=()):
+        # sql carries an "{ids}" placeholder for the IN list, which is split
+        # to stay under SQLite's bound variable limit.
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), SQL_VARIABLE_LIMIT):
+            chunk = values[start:start + SQL_VARIABLE_LIMIT]
+            rows.extend(self._query(sql.format(ids=', '.join('?' for _ in chunk)), [*params, *chunk]))
+        return rows
+
+    def _select(self, table, ids=None):
+        if ids is None:
+            return self._query(f"SELECT * FROM {table} ORDER BY id")
+        rows = {row['id']: row for row in self._query_in(f"SELECT * FROM {table} WHERE id IN ({{ids}})", ids)}
+        return [rows[record_id] for record_id in ids if record_id in rows]
+
+    def _decode(self, row):
+        record = dict(row)
+        for column in JSON_COLUMNS.intersection(record):
+            record[column] = json.loads(record[column])
+        return record
+
+    def _encode(self, column, value):
+        return json.dumps(value) if column in JSON_COLUMNS else value
+
+    def _records(self, table, rows):
+        record_type = TABLE_RECORDS[table]
+        return [record_type(**row) for row in rows]
+
+    def _insert(self, table, record):
+        # Unset (None) fields are left out so column defaults apply
+        columns = [c for c in self._columns[table] if c != "id" and record.get(c) is not None]
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        values = [self._encode(c, record[c]) for c in columns]
+        with self.transaction() as conn:
+            record_id = conn.execute(sql, values).lastrowid
+            self._pending.append((table, record_id))
+            self._log("insert", table, record_id, dict(zip(columns, values)))
+        return record_id
+
+    def _update(self, table, key, value, fields):
+        columns = [c for c in fields if c in self._columns[table] and c not in ("id", key)]
+        if not columns:
+            return
+        sql = f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE {key} = ?"
+        values = [self._encode(c, fields[c]) for c in columns]
+        with self.transaction() as conn:
+            conn.execute(sql, values + [value])
+            for row in conn.execute(f"SELECT id FROM {table} WHERE {key} = ?", (value,)):
+                self._pending.append((table, row['id']))
+                self._log("update", table, row['id'], dict(zip(columns, values)))
+
+    def _log(self, op, table, record_id, fields):
+        if self.event_log is not None:
+            self._events.append({"seq": None, "at": round(time.time(), 3), "op": op, "table": table,
+                                 "id": record_id, "fields": fields})
+
+    def replay(self, events):
+        # Applies logged inserts and updates on top of a snapshot, then
+        # recomputes what is derived from them (rollups and counters)
+        replayed = last_seq = 0
+        with self.transaction() as conn:
+            for event in events:
+                table = event['table']
+                fields = {c: v for c, v in event['fields'].items() if c in self._columns[table]}
+                if event['op'] == "insert":
+                    columns = ["id", *fields]
+                    conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                 f"VALUES ({', '.join('?' for _ in columns)}) ON CONFLICT (id) DO UPDATE SET "
+                                 f"{', '.join(f'{c} = excluded.{c}' for c in fields)}", [event['id'], *fields.values()])
+                elif fields:
+                    conn.execute(f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in fields)} WHERE id = ?",
+                                 [*fields.values(), event['id']])
+                if table == "materials" and fields.get('price_cents') is not None:
+                    self._record_price(conn, event['id'], fields.get('updated_at') or int(event['at']),
+                                       fields['price_cents'])
+                conn.execute("INSERT OR IGNORE INTO event_index (tbl, record_id, seq) VALUES (?, ?, ?)",
+                             (table, event['id'], event['seq']))
+                replayed += 1
+                last_seq = event['seq']
+            if replayed:
+                _run_script(conn, ROLLUP_REBUILD)
+                conn.execute("INSERT OR REPLACE INTO sequences (name, value) "
+                             "SELECT 'orders', COALESCE(MAX(CAST(substr(order_id, 5) AS INTEGER)), 0) FROM orders")
+                conn.execute("INSERT OR REPLACE INTO sequences (name, value) SELECT 'purchase_orders', "
+                             "COALESCE(MAX(CAST(substr(purchase_order, 4) AS INTEGER)), 0) FROM orders")
+                conn.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES ('events', ?)", (last_seq,))
+        return replayed
+
+    def history(self, table, record_id):
+        # Logged changes of one record, oldest first. The index says which
+        # events to read; the parsed list is kept until the record changes.
+        if self.event_log is None:
+            return []
+        seqs = tuple(row['seq'] for row in self._query(
+            "SELECT seq FROM event_index WHERE tbl = ? AND record_id = ? ORDER BY seq", (table, record_id)))
+        with self._lock:
+            cached = self._history.get((table, record_id))
+        if cached is not None and cached[0] == seqs:
+            return cached[1]
+        events = self.event_log.read(seqs)
+        # Events still queued for writing are picked up on a later call
+        if len(events) == len(seqs):
+            with self._lock:
+                self._history[(table, record_id)] = (seqs, events)
+                while len(self._history) > HISTORY_CACHE_SIZE:
+                    del self._history[next(iter(self._history))]
+        return events
+
+    def get_record(self, table, record_id):
+        rows = self._records(table, self._select(table, [record_id]))
+        return rows[0] if rows else None
+
+    def list_ids(self, table, **where):
+        # Equality filters on indexed owner columns (user_id, supplier, ...)
+        # let dashboards touch only the rows that belong to one user.
+        columns = [column for column in where if column in self._columns[table]]
+        clause = f" WHERE {' AND '.join(f'{c} = ?' for c in columns)}" if columns else ""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT id FROM {table}{clause} ORDER BY id", [where[c] for c in columns])]
+
+    def list_records(self, table):
+        return self._records(table, self._select(table))
+
+    def iter_records(self, table, batch_size=1000, **where):
+        # Keyset pagination: only one batch is held at a time and the lock is
+        # released between batches, so exports don't stall other sessions.
+        columns = [column for column in where if column in self._columns[table]]
+        clause = "".join(f" AND {c} = ?" for c in columns)
+        last_id = 0
+        while True:
+            rows = self._query(f"SELECT * FROM {table} WHERE id > ?{clause} ORDER BY id LIMIT ?",
+                               [last_id, *(where[c] for c in columns), batch_size])
+            yield from self._records(table, rows)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def next_id(self, name, count=1):
+        # Atomic counter shared by every process on this database; BEGIN
+        # IMMEDIATE serialises allocations, so a number is never handed out
+        # twice. Reserves `count` numbers and returns the last.
+        with self.transaction() as conn:
+            return conn.execute(
+                "INSERT INTO sequences (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value",
+                (name, count)).fetchone()[0]
+
+    def count(self, table):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _add_files(self, owner_type, owner_id, files):
+        # Files are handles into self.blobs; the bytes never enter the database.
+        # Rejected uploads are kept with their error and no handle.
+        for file_info in files:
+            self._insert("files", {
+                "owner_type": owner_type,
+                "owner_id": owner_id,
+                "name": file_info['name'],
+                "type": file_info.get('type'),
+                "sha256": file_info.get('sha256'),
+                "size": file_info.get('size'),
+                "thumbnail": file_info.get('thumbnail'),
+                "error": file_info.get('error')
+            })
+
+    def finish_upload(self, owner_type, owner_id, files, files_status):
+        # Called by the upload pipeline: the files appear together with the
+        # owner's new status, in one transaction.
+        with self.transaction():
+            self._add_files(owner_type, owner_id, files)
+            self._update(OWNER_TABLES[owner_type], "id", owner_id, {"files_status": files_status})
+
+    def _files_by_owner(self, owner_type, owner_ids):
+        files = {owner_id: [] for owner_id in owner_ids}
+        rows = self._query_in(
+            "SELECT owner_id, name, type, sha256, size, thumbnail, error FROM files WHERE owner_type = ? "
+            "AND owner_id IN ({ids}) ORDER BY id",
+            files, [owner_type])
+        for row in rows:
+            files[row.pop('owner_id')].append(row)
+        return files
+
+    def add_project(self, project):
+        with self.transaction() as conn:
+            project_id = self._insert("projects", project.as_row())
+            self._add_files("project", project_id, project.files)
+            conn.execute("INSERT INTO project_type_rollups (user_id, type, projects, bids, bid_total_cents) "
+                         "VALUES (?, ?, 1, 0, 0) ON CONFLICT (user_id, type) DO UPDATE SET projects = projects + 1",
+                         (project.user_id or '', project.type))
+        return project_id
+
+    def get_project(self, project_id):
+        projects = self.list_projects([project_id])
+        return projects[0] if projects else None
+
+    def list_projects(self, ids=None):
+        projects = self._records("projects", self._select("projects", ids))
+        ids = [project.id for project in projects]
+        files = self._files_by_owner("project", ids)
+        bids = {project_id: [] for project_id in ids}
+        for bid in self._list_bids(ids):
+            bids[bid.project_id].append(bid)
+        for project in projects:
+            project.files = files[project.id]
+            project.bids = bids[project.id]
+        return projects
+
+    def add_bid(self, project_id, bid):
+        bid.project_id = project_id
+        with self.transaction() as conn:
+            bid_id = self._insert("bids", bid.as_row())
+            self._add_files("bid", bid_id, bid.files)
+            self._roll_up_bid(conn, project_id, bid.amount_cents)
+        return bid_id
+
+    def _roll_up_bid(self, conn, project_id, amount_cents):
+        # Bids are never edited or removed, so min/max only ever widen
+        conn.execute(
+            "INSERT INTO bid_rollups (project_id, bids, total_cents, min_cents, max_cents) VALUES (?, 1, ?, ?, ?) "
+            "ON CONFLICT (project_id) DO UPDATE SET bids = bids + 1, total_cents = total_cents + excluded.total_cents, "
+            "min_cents = MIN(min_cents, excluded.min_cents), max_cents = MAX(max_cents, excluded.max_cents)",
+            (project_id, amount_cents, amount_cents, amount_cents))
+        conn.execute("UPDATE project_type_rollups SET bids = bids + 1, bid_total_cents = bid_total_cents + ? "
+                     "WHERE (user_id, type) = (SELECT COALESCE(user_id, ''), type FROM projects WHERE id = ?)",
+                     (amount_cents, project_id))
+
+    def list_bids(self, ids):
+        # Bids with the title and location of the project they were placed on
+        bids = {bid.id: bid for bid in self._records("bids", self._query_in(
+            "SELECT bids.*, projects.title AS project_title, projects.location AS project_location "
+            "FROM bids JOIN projects ON projects.id = bids.project_id WHERE bids.id IN ({ids})", ids))}
+        files = self._files_by_owner("bid", list(bids))
+        for bid in bids.values():
+            bid.files = files[bid.id]
+        return [bids[bid_id] for bid_id in ids if bid_id in bids]
+
+    def _list_bids(self, project_ids):
+        bids = self._records("bids", self._query_in(
+            "SELECT * FROM bids WHERE project_id IN ({ids}) ORDER BY id", project_ids))
+        files = self._files_by_owner("bid", [bid.id for bid in bids])
+        for bid in bids:
+            bid.files = files[bid.id]
+        return bids
+
+    def add_material(self, material):
+        with self.transaction() as conn:
+            material_id = self._insert("materials", _stocked(_locate(material.as_row())))
+            if material.price_cents is not None:
+                self._record_price(conn, material_id, material.updated_at or now_ts(), material.price_cents)
+        return material_id
+
+    def get_material(self, material_id):
+        return self.get_record("materials", material_id)
+
+    def list_materials(self, ids=None):
+        return self._records("materials", self._select("materials", ids))
+
+    def update_material(self, material_id, **fields):
+        with self.transaction() as conn:
+            self._update("materials", "id", material_id, _locate(fields))
+            self._sync_availability(conn, material_id)
+            if fields.get("price_cents") is not None:
+                self._record_price(conn, material_id, fields.get("updated_at") or now_ts(), fields["price_cents"])
+
+    def set_stock(self, material_id, stock, expected):
+        # A supplier's count replaces the stock only if it is still the
+        # `expected` one they were looking at; an order placed meanwhile
+        # raises ValueError instead of being silently undone
+        with self.transaction() as conn:
+            if not conn.execute("UPDATE materials SET stock = ? WHERE id = ? AND stock IS ? RETURNING id",
+                                (stock, material_id, expected)).fetchall():
+                row = conn.execute("SELECT stock FROM materials WHERE id = ?", (material_id,)).fetchone()
+                raise ValueError(f"The stock changed to {row['stock'] if row else 0} while you were editing; "
+                                 "please check it and save again")
+            self._pending.append(("materials", material_id))
+            self._log("update", "materials", material_id, {"stock": stock})
+            self._sync_availability(conn, material_id)
+
+    def adjust_stock(self, material_id, change):
+        with self.transaction() as conn:
+            self._adjust_stock(conn, material_id, change)
+
+    def _adjust_stock(self, conn, material_id, change):
+        # Adds `change` units (negative to take them) to a tracked material
+        # in the caller's transaction. The check and the decrement are one
+        # conditional UPDATE, so no other checkout, in this process or
+        # another, can take the same units in between. Raises ValueError,
+        # rolling the caller back, when there are not enough units left.
+        rows = conn.execute("UPDATE materials SET stock = stock + ? WHERE id = ? AND stock + ? >= 0 RETURNING stock",
+                            (change, material_id, change)).fetchall()
+        if not rows:
+            row = conn.execute("SELECT name, stock FROM materials WHERE id = ?", (material_id,)).fetchone()
+            if row is not None and row['stock'] is not None:
+                raise ValueError(f"Only {row['stock']:,} units of {row['name']} left in stock")
+            return
+        self._pending.append(("materials", material_id))
+        self._log("update", "materials", material_id, {"stock": rows[0]['stock']})
+        self._sync_availability(conn, material_id)
+
+    def _sync_availability(self, conn, material_id):
+        # Re-derives the label of a tracked material after its stock or
+        # minimum order changed; the caller has already marked it changed
+        row = conn.execute("SELECT stock, minimum_order, availability FROM materials WHERE id = ?",
+                           (material_id,)).fetchone()
+        if row is None or row['stock'] is None:
+            return
+        availability = stock_availability(row['stock'], row['minimum_order'])
+        if availability != row['availability']:
+            conn.execute("UPDATE materials SET availability = ? WHERE id = ?", (availability, material_id))
+            self._log("update", "materials", material_id, {"availability": availability})
+
+    def _record_price(self, conn, material_id, ts, price_cents):
+        # Appends to the material's series and folds the point into its day
+        # and week buckets, in the caller's transaction. Saves that leave the
+        # price as it was add nothing.
+        row = conn.execute("SELECT timestamps, prices FROM price_series WHERE material_id = ?",
+                           (material_id,)).fetchone()
+        series = PriceSeries.from_blobs(row['timestamps'], row['prices']) if row else PriceSeries()
+        if series.price_at(ts) == price_cents:
+            return
+        series.append(ts, price_cents)
+        conn.execute("INSERT OR REPLACE INTO price_series (material_id, timestamps, prices) VALUES (?, ?, ?)",
+                     (material_id, *series.to_blobs()))
+        for period in PERIODS:
+            conn.execute(PRICE_ROLLUP_UPSERT, (material_id, period, bucket_start(ts, period),
+                                               price_cents, price_cents, price_cents))
+
+    def price_series(self, material_id):
+        rows = self._query("SELECT timestamps, prices FROM price_series WHERE material_id = ?", (material_id,))
+        return PriceSeries.from_blobs(rows[0]['timestamps'], rows[0]['prices']) if rows else PriceSeries()
+
+    def price_rollups(self, material_ids, period, start=0):
+        # Bucket rows per material, oldest first; one query for a page of results
+        rollups = {material_id: [] for material_id in material_ids}
+        for row in self._query_in(
+                "SELECT material_id, start, min_cents, max_cents, total_cents, points FROM price_rollups "
+                "WHERE period = ? AND start >= ? AND material_id IN ({ids}) ORDER BY material_id, start",
+                material_ids, (period, start)):
+            rollups[row['material_id']].append(row)
+        return rollups
+
+    def upsert_materials(self, materials):
+        # Matches on (supplier, name); one transaction for the whole batch.
+        # A stock count only starts tracking: a file exported before orders
+        # were placed must not put their units back, so a row giving a
+        # different count for a tracked material is rejected. Returns
+        # (inserted, updated, [(position, error), ...]).
+        inserted = updated = 0
+        rejected = []
+        with self.transaction() as conn:
+            for position, material in enumerate(materials):
+                row = conn.execute("SELECT id, stock FROM materials WHERE supplier = ? AND name = ? ORDER BY id "
+                                   "LIMIT 1", (material.supplier, material.name)).fetchone()
+                fields = _locate({field: value for field, value in material.as_row().items() if value is not None})
+                if row is not None and row['stock'] is not None and "stock" in fields:
+                    if fields.pop("stock") != row['stock']:
+                        rejected.append((position, f"Stock is tracked for {material.name} ({row['stock']:,} units "
+                                                   "now); use Units Received to adjust it"))
+                        continue
+                if row is None:
+                    material_id = self._insert("materials", _stocked(fields))
+                    inserted += 1
+                else:
+                    material_id = row['id']
+                    self._update("materials", "id", material_id, fields)
+                    self._sync_availability(conn, material_id)
+                    updated += 1
+                if material.price_cents is not None:
+                    self._record_price(conn, material_id, material.updated_at or now_ts(), material.price_cents)
+        return inserted, updated, rejected
+
+    def add_order(self, order):
+        if order.quantity <= 0:
+            raise ValueError(f"Order quantity for {order.material} must be at least 1 unit")
+        with self.transaction() as conn:
+            # The units are taken first; without them nothing is written
+            if order.material_id is not None and order.status != OrderStatus.CANCELLED:
+                self._adjust_stock(conn, order.material_id, -order.quantity)
+            if order.order_id is None:
+                order.order_id = f"ORD-{self.next_id('orders'):04d}"
+            order.id = self._insert("orders", order.as_row())
+            self._roll_up_order(conn, order.supplier, order.status, order.ordered_at, 1, order.total_cents)
+            if order.status != OrderStatus.CANCELLED:
+                self._roll_up_material(conn, order.supplier, order.material, 1, order.quantity, order.total_cents)
+        return order.order_id
+
+    def add_purchase_orders(self, orders):
+        # Checkout: the lines of a cart become one purchase order per
+        # supplier, all written in one transaction. Order and purchase order
+        # numbers are reserved in one step each, and a line short of stock
+        # fails the whole checkout with ValueError. Returns
+        # {supplier: (purchase_order, [order_id, ...])}.
+        suppliers = list(dict.fromkeys(order.supplier for order in orders))
+        purchase_orders = {}
+        with self.transaction():
+            last_order = self.next_id("orders", len(orders))
+            last_purchase_order = self.next_id("purchase_orders", len(suppliers))
+            for number, supplier in enumerate(suppliers, start=last_purchase_order - len(suppliers) + 1):
+                purchase_orders[supplier] = (f"PO-{number:04d}", [])
+            for number, order in enumerate(orders, start=last_order - len(orders) + 1):
+                order.order_id = f"ORD-{number:04d}"
+                order.purchase_order, order_ids = purchase_orders[order.supplier]
+                order_ids.append(self.add_order(order))
+        return purchase_orders
+
+    def _roll_up_order(self, conn, supplier, status, ordered_at, orders, total_cents):
+        # Adds signed deltas to one (supplier, status, month) bucket
+        conn.execute(
+            "INSERT INTO order_rollups (supplier, status, month, orders, total_cents) "
+            "VALUES (?, ?, strftime('%Y-%m', ?, 'unixepoch', 'localtime'), ?, ?) "
+            "ON CONFLICT (supplier, status, month) DO UPDATE SET orders = orders + excluded.orders, "
+            "total_cents = total_cents + excluded.total_cents",
+            (supplier, status, ordered_at, orders, total_cents))
+
+    def _roll_up_material(self, conn, supplier, material, orders, quantity, total_cents):
+        # Signed deltas to one (supplier, material) bucket; cancelled orders
+        # are left out, as they are from revenue
+        conn.execute(
+            "INSERT INTO material_order_rollups (supplier, material, orders, quantity, total_cents) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (supplier, material) DO UPDATE SET orders = orders + excluded.orders, "
+            "quantity = quantity + excluded.quantity, total_cents = total_cents + excluded.total_cents",
+            (supplier, material, orders, quantity, total_cents))
+
+    def list_orders(self, ids=None):
+        return self._records("orders", self._select("orders", ids))
+
+    def update_order(self, order_id, **fields):
+        with self.transaction() as conn:
+            old = conn.execute("SELECT supplier, status, ordered_at, total_cents, quantity, material, material_id "
+                               "FROM orders WHERE id = ?", (order_id,)).fetchone()
+            self._update("orders", "id", order_id, fields)
+            if old is not None and "status" in fields and fields["status"] != old['status']:
+                # Move the order from its old status bucket to the new one
+                self._roll_up_order(conn, old['supplier'], old['status'], old['ordered_at'], -1, -old['total_cents'])
+                self._roll_up_order(conn, old['supplier'], fields["status"], old['ordered_at'], 1, old['total_cents'])
+                if OrderStatus.CANCELLED in (fields["status"], old['status']):
+                    sign = -1 if fields["status"] == OrderStatus.CANCELLED else 1
+                    self._roll_up_material(conn, old['supplier'], old['material'], sign, sign * old['quantity'],
+                                           sign * old['total_cents'])
+                # A cancelled order gives its units back and reopening it
+                # takes them again. The old status is read inside this write
+                # transaction, so two cancellations cannot both release.
+                if old['material_id'] is not None:
+                    if fields["status"] == OrderStatus.CANCELLED:
+                        self._adjust_stock(conn, old['material_id'], old['quantity'])
+                    elif old['status'] == OrderStatus.CANCELLED:
+                        self._adjust_stock(conn, old['material_id'], -old['quantity'])
+
+    def order_totals(self, supplier):
+        # Rollup rows for one supplier: a handful per status and month
+        return self._query("SELECT status, month, orders, total_cents FROM order_rollups "
+                           "WHERE supplier = ? AND orders > 0 ORDER BY month DESC, status", (supplier,))
+
+    def material_totals(self, supplier, limit=10):
+        return self._query("SELECT material, orders, quantity, total_cents FROM material_order_rollups "
+                           "WHERE supplier = ? AND orders > 0 ORDER BY total_cents DESC LIMIT ?", (supplier, limit))
+
+    def bid_totals(self, project_ids):
+        return {row['project_id']: row for row in self._query_in(
+            "SELECT project_id, bids, total_cents, min_cents, max_cents FROM bid_rollups "
+            "WHERE project_id IN ({ids})", project_ids)}
+
+    def project_type_totals(self, user_id):
+        return self._query("SELECT type, projects, bids, bid_total_cents FROM project_type_rollups "
+                           "WHERE user_id = ? ORDER BY type", (user_id,))
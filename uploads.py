@@ -0,0 +1,94 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+from records import FileStatus
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+LOGGER = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp", "bmp", "tif", "tiff"}
+ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | {"pdf", "dwg", "dxf", "doc", "docx", "xls", "xlsx", "csv", "txt", "zip"}
+MAX_FILE_SIZE = 100 * 1024 * 1024
+THUMBNAIL_SIZE = (320, 320)
+
+
+def extension(name):
+    return os.path.splitext(name)[1].lstrip(".").lower()
+
+
+def check_file(name, size):
+    # Returns why a file is refused, or None
+    if extension(name) not in ALLOWED_EXTENSIONS:
+        return f"File type .{extension(name) or '?'} is not accepted"
+    if size > MAX_FILE_SIZE:
+        return f"File is larger than {MAX_FILE_SIZE // (1024 * 1024)} MB"
+    return None
+
+
+def make_thumbnail(blobs, digest, name):
+    # Images are scaled down; PDFs get their first page rendered when
+    # pypdfium2 is installed. Anything unreadable simply has no preview.
+    file_type = extension(name)
+    if Image is None or (file_type not in IMAGE_EXTENSIONS and (file_type != "pdf" or pypdfium2 is None)):
+        return None
+    try:
+        if file_type == "pdf":
+            document = pypdfium2.PdfDocument(blobs.path(digest))
+            try:
+                image = document[0].render(scale=0.5).to_pil()
+            finally:
+                document.close()
+        else:
+            image = Image.open(blobs.path(digest))
+        with image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            preview = io.BytesIO()
+            image.convert("RGB").save(preview, "JPEG", quality=80)
+    except Exception:
+        LOGGER.warning("Could not build a preview for %s", name, exc_info=True)
+        return None
+    return blobs.put(preview)['sha256']
+
+
+class UploadPipeline:
+    def __init__(self, store, max_workers=4):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="uploads")
+
+    def submit(self, owner_type, owner_id, uploaded_files):
+        # The owner record is saved as processing first; this returns at once
+        # and the files are stored, checked and previewed on a worker thread.
+        return self._executor.submit(self._process, owner_type, owner_id, list(uploaded_files))
+
+    def _process(self, owner_type, owner_id, uploaded_files):
+        try:
+            files = [self._process_file(uploaded_file) for uploaded_file in uploaded_files]
+        except Exception:
+            LOGGER.exception("Upload processing failed for %s %s", owner_type, owner_id)
+            self.store.finish_upload(owner_type, owner_id, [], FileStatus.FAILED)
+            raise
+        self.store.finish_upload(owner_type, owner_id, files, FileStatus.READY)
+
+    def _process_file(self, uploaded_file):
+        with METRICS.section("upload_file"):
+            file_info = {'name': uploaded_file.name, 'type': uploaded_file.type}
+            error = check_file(uploaded_file.name, uploaded_file.size)
+            if error:
+                file_info['error'] = error
+                return file_info
+            # Streams in chunks and hashes as it goes
+            file_info.update(self.store.blobs.put(uploaded_file))
+            file_info['thumbnail'] = make_thumbnail(self.store.blobs, file_info['sha256'], uploaded_file.name)
+            return file_info